@@ -4,6 +4,7 @@ from .suites import stability
 from .suites.stability import Ingest
 from .suites.stability import StreamProtocol
 from .utils.generate_device_settings import BitrateRateControl
+from .utils.network_capture import CaptureBackend
 from .utils.runner import create_parser
 from .utils.runner import run
 from .utils.traffic_shaper import PROFILES_HELP
@@ -42,6 +43,14 @@ def parse_video_bitrate_control(value: str) -> BitrateRateControl:
         raise argparse.ArgumentTypeError(f"'{value}' is not one of {choices}") from None
 
 
+def parse_network_capture_backend(value: str) -> CaptureBackend:
+    try:
+        return CaptureBackend(value.strip().lower())
+    except ValueError:
+        choices = ", ".join(CaptureBackend)
+        raise argparse.ArgumentTypeError(f"'{value}' is not one of {choices}") from None
+
+
 def parse_traffic_shaping(value: str) -> Profile:
     try:
         return parse_profile(value)
@@ -66,7 +75,7 @@ def create_suites(moblin, args):
             3600 * args.duration,
             shaper,
             args.video_bitrate_control,
-            args.network_capture,
+            args.network_capture_backend if args.network_capture else None,
         )
     ]
 
@@ -117,6 +126,14 @@ def main():
         action="store_true",
         help="Capture the packets to and from the device to a pcap file for the whole test run.",
     )
+    parser.add_argument(
+        "--network-capture-backend",
+        type=parse_network_capture_backend,
+        choices=list(CaptureBackend),
+        default=CaptureBackend.TCPDUMP,
+        help="Network capture backend. 'ring' counts the packets in memory instead of writing a pcap "
+        "file, and only works on Linux (default: %(default)s).",
+    )
     parser.add_argument(
         "-s",
         "--stream-traffic-shaping",
@@ -132,4 +149,5 @@ def main():
     run("stability", parser, create_suites)
 
 
-main()
+if __name__ == "__main__":
+    main()
@@ -61,7 +61,7 @@ class DjiCameraRtmpServer(TestCase):
         self.assert_presentation_time_stamps(
             recording,
             1 / 30,
-            [frame.pts for frame in metadata.video.frames],
+            metadata.video.frames.pts,
             "video",
         )
         self.assert_not_all_black(read_video_frame(recording, 5))
@@ -70,7 +70,7 @@ class DjiCameraRtmpServer(TestCase):
         self.assert_presentation_time_stamps(
             recording,
             1024 / 48000,
-            [frame.pts for frame in metadata.audio.frames],
+            metadata.audio.frames.pts,
             "audio",
         )
         mean_volume_db = measure_mean_volume(recording)
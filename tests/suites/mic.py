@@ -227,15 +227,13 @@ class MicSwitch(TestCase):
 
     def _assert_nothing_missing(self, path: Path):
         video = ffprobe_video(path)
-        self.assert_presentation_time_stamps(
-            path, 1 / STREAM_FPS, [frame.pts for frame in video.frames], "video"
-        )
+        self.assert_presentation_time_stamps(path, 1 / STREAM_FPS, video.frames.pts, "video")
         audio = ffprobe_audio(path)
         self.assert_equal(audio.sample_rate, 48000)
         # self.assert_presentation_time_stamps(
         #     path,
         #     AUDIO_SAMPLES_PER_FRAME / audio.sample_rate,
-        #     [frame.pts for frame in audio.frames],
+        #     audio.frames.pts,
         # )
 
     def _assert_alerts_synchronized(self, path: Path):
@@ -44,6 +44,7 @@ from ..utils.generate_device_settings import video_source_widget_settings
 from ..utils.mediamtx import MediaMtx
 from ..utils.moblin import Moblin
 from ..utils.monitor import Monitor
+from ..utils.network_capture import CaptureBackend
 from ..utils.network_capture import CaptureStream
 from ..utils.network_capture import NetworkCapture
 from ..utils.test_case import TestCase
@@ -141,7 +142,7 @@ class StabilityIngestsOneStream(TestCase):
         duration: float,
         shaper: TrafficShaper | None,
         video_bitrate_control: BitrateRateControl,
-        network_capture: bool,
+        network_capture: CaptureBackend | None,
     ):
         super().__init__(moblin)
         self._ingests = ingests
@@ -285,7 +286,7 @@ class StabilityIngestsOneStream(TestCase):
                 self._go_live(stream_recorder)
             if self._record:
                 self.moblin.start_recording()
-            self._monitor = self._create_monitor(stream_recorder, sources)
+            self._monitor = self._create_monitor(stream_recorder, sources, capture)
             self._monitor_until_done(self._monitor, stream_recorder, sources, capture)
             if stream_recorder is not None:
                 self.moblin.end()
@@ -456,7 +457,12 @@ class StabilityIngestsOneStream(TestCase):
         )
         wait_until(lambda: stream_recorder.total_bytes() > 3_000_000, "the stream to be recorded to disk")
 
-    def _create_monitor(self, stream_recorder: StreamRecorder | None, sources: list[Source]) -> Monitor:
+    def _create_monitor(
+        self,
+        stream_recorder: StreamRecorder | None,
+        sources: list[Source],
+        capture: NetworkCapture | None,
+    ) -> Monitor:
         return Monitor(
             moblin=self.moblin,
             stream_recorder=stream_recorder,
@@ -466,19 +472,34 @@ class StabilityIngestsOneStream(TestCase):
             ingests_bitrate_range=self._ingests_bitrate_range,
             duration=self._duration,
             shaper=self._shaper,
+            captured_bitrates=None if capture is None else capture.current_bitrates,
         )
 
     def _enter_network_capture(self, stack: ExitStack) -> NetworkCapture | None:
-        if not self._network_capture:
+        if self._network_capture is None:
             return None
         hosts = [self.moblin.ip_address]
         if self._shaper is not None:
             hosts.append(self._shaper.ip_address)
         streams = [
-            CaptureStream(relay.name, relay.protocol, relay.port) for relay in relays(self._stream_protocol)
+            CaptureStream(
+                relay.name,
+                relay.protocol,
+                relay.port,
+                srt=is_relay_of(relay, self._stream_protocol, StreamProtocol.SRT, SRT_SERVER_PORT),
+                rtmp=is_relay_of(relay, self._stream_protocol, StreamProtocol.RTMP, RTMP_SERVER_PORT),
+            )
+            for relay in relays(self._stream_protocol)
         ]
         self._capture = stack.enter_context(
-            NetworkCapture(hosts, FILES_DIR, STREAM_PATH, streams, self._capture_settings())
+            NetworkCapture(
+                hosts,
+                FILES_DIR,
+                STREAM_PATH,
+                streams,
+                self._capture_settings(),
+                self._network_capture,
+            )
         )
         return self._capture
 
@@ -543,6 +564,14 @@ def relays(stream_protocol: StreamProtocol) -> list[Relay]:
     return [stream_relay(stream_protocol)] + INGEST_RELAYS
 
 
+def is_relay_of(
+    relay: Relay, stream_protocol: StreamProtocol, protocol: StreamProtocol, ingest_port: int
+) -> bool:
+    if relay.group == Group.STREAM:
+        return stream_protocol == protocol
+    return relay.port == ingest_port
+
+
 def stream_recorder_url(stream_protocol: StreamProtocol) -> str:
     match stream_protocol:
         case StreamProtocol.SRT:
@@ -697,7 +726,7 @@ def tests(
     duration: float,
     shaper: TrafficShaper | None,
     video_bitrate_control: BitrateRateControl,
-    network_capture: bool,
+    network_capture: CaptureBackend | None,
 ):
     return [
         StabilityIngestsOneStream(
@@ -6,10 +6,10 @@ from ..utils.config import RTMP_SERVER_PORT
 from ..utils.config import SRT_CLIENT_TALKBACK_SERVER_PORT
 from ..utils.config import SRT_SERVER_PORT
 from ..utils.config import srt_listener_url
+from ..utils.decoder import detect_beeps
 from ..utils.ffmpeg import BEEP_INTERVAL
 from ..utils.ffmpeg import FfmpegAudioTestStream
 from ..utils.ffmpeg import TransportFormat
-from ..utils.ffmpeg import detect_beeps
 from ..utils.generate_device_settings import mic_id
 from ..utils.generate_device_settings import uuid
 from ..utils.moblin import Moblin
@@ -34,4 +34,5 @@ def main():
     run("test", parser, create_suites)
 
 
-main()
+if __name__ == "__main__":
+    main()
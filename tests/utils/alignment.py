@@ -0,0 +1,123 @@
+from collections.abc import Sequence
+from dataclasses import dataclass
+from logging import Logger
+
+import numpy as np
+
+# Matched events whose offset differs from the fitted offset by more than this many median
+# absolute deviations are outliers.
+OUTLIER_DEVIATIONS = 5.0
+
+
+@dataclass
+class Line:
+    intercept: float
+    slope: float
+
+
+def fit_line(x: Sequence[float] | np.ndarray, y: Sequence[float] | np.ndarray) -> Line:
+    """The least squares line through the points, which is flat for fewer than two of them."""
+    x = np.asarray(x, np.float64)
+    y = np.asarray(y, np.float64)
+    if len(x) == 0:
+        return Line(0.0, 0.0)
+    mean_x = x.mean()
+    mean_y = y.mean()
+    denominator = np.square(x - mean_x).sum()
+    if denominator == 0:
+        return Line(float(mean_y), 0.0)
+    slope = ((x - mean_x) * (y - mean_y)).sum() / denominator
+    return Line(float(mean_y - slope * mean_x), float(slope))
+
+
+@dataclass
+class Alignment:
+    """How events line up with reference events. An event is expected at its reference plus
+    the offset, plus the drift times the time since the first reference.
+    """
+
+    offset: float
+    drift: float
+    matches: list[float | None]
+    outliers: list[int]
+
+    def log(self, logger: Logger, name: str):
+        logger.debug(
+            "%s: %s of %s matched, offset %.3f s, drift %.0f ms/h, outliers: %s",
+            name,
+            sum(1 for match in self.matches if match is not None),
+            len(self.matches),
+            self.offset,
+            3600_000 * self.drift,
+            ", ".join(str(index) for index in self.outliers) or "none",
+        )
+
+
+def align_events(
+    references: Sequence[float],
+    events: Sequence[float],
+    tolerance: float,
+    resolution: float,
+) -> Alignment:
+    """Aligns two streams of event times, like alert triggers and their sounds in a recording,
+    which are in different clocks. The offset is the peak of the histogram of the differences
+    of all pairs, which is the cross-correlation of the streams binned at the resolution. Every
+    reference is then matched with the nearest event within the tolerance of its expected time,
+    and the offset and drift are fitted to the matches.
+    """
+    reference_times = np.asarray(references, np.float64)
+    event_times = np.sort(np.asarray(events, np.float64))
+    if len(reference_times) == 0 or len(event_times) == 0:
+        return Alignment(0.0, 0.0, [None] * len(reference_times), [])
+    first = reference_times.min()
+    line = Line(_histogram_offset(reference_times, event_times, resolution), 0.0)
+    outliers = np.zeros(len(reference_times), bool)
+    for _ in range(2):
+        indexes = _nearest(event_times, reference_times + _at(line, reference_times - first), tolerance)
+        matched = indexes >= 0
+        if not matched.any():
+            break
+        offsets = event_times[indexes] - reference_times
+        line = fit_line(reference_times[matched] - first, offsets[matched])
+        residuals = offsets - _at(line, reference_times - first)
+        deviation = np.median(np.abs(residuals[matched] - np.median(residuals[matched])))
+        outliers = matched & (np.abs(residuals) > max(OUTLIER_DEVIATIONS * deviation, resolution))
+        if outliers.any() and np.count_nonzero(matched & ~outliers) > 0:
+            inliers = matched & ~outliers
+            line = fit_line(reference_times[inliers] - first, offsets[inliers])
+    return Alignment(
+        offset=line.intercept,
+        drift=line.slope,
+        matches=[float(event_times[index]) if index >= 0 else None for index in indexes.tolist()],
+        outliers=np.flatnonzero(outliers).tolist(),
+    )
+
+
+def _at(line: Line, x: np.ndarray) -> np.ndarray:
+    return line.intercept + line.slope * x
+
+
+def _histogram_offset(references: np.ndarray, events: np.ndarray, resolution: float) -> float:
+    reference_bins = np.rint((references - references.min()) / resolution).astype(np.int64)
+    event_bins = np.rint((events - events.min()) / resolution).astype(np.int64)
+    size = 1 << int(reference_bins.max() + event_bins.max() + 1).bit_length()
+    correlation = np.fft.irfft(
+        np.fft.rfft(np.bincount(event_bins, minlength=size))
+        * np.conj(np.fft.rfft(np.bincount(reference_bins, minlength=size))),
+        size,
+    )
+    counts = np.rint(correlation + np.roll(correlation, 1) + np.roll(correlation, -1))
+    lag = int(np.argmax(counts))
+    if lag > event_bins.max():
+        lag -= size
+    return float(events.min() - references.min() + lag * resolution)
+
+
+def _nearest(values: np.ndarray, targets: np.ndarray, tolerance: float) -> np.ndarray:
+    """The indexes of the nearest sorted values of the targets, or -1 if further away than the
+    tolerance.
+    """
+    right = np.searchsorted(values, targets).clip(max=len(values) - 1)
+    left = (right - 1).clip(min=0)
+    nearest = np.where(np.abs(values[left] - targets) <= np.abs(values[right] - targets), left, right)
+    return np.where(np.abs(values[nearest] - targets) <= tolerance, nearest, -1)
@@ -1,17 +1,24 @@
-import bisect
 import logging
-import statistics
 from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
 
-from .ffmpeg import AudioBandLevel
-from .ffmpeg import detect_audio_onsets
+import numpy as np
+
+from .alignment import align_events
+from .alignment import fit_line
+from .decoder import AudioSignal
+from .decoder import AudioSignalAnalyzer
+from .decoder import RegionColorsAnalyzer
+from .decoder import decode_recording
+from .decoder import read_keyframes
+from .decoder import read_region_colors
+from .decoder import split_keyframes
+from .decoder import true_runs
+from .decoder import window_segments
+from .ffmpeg import FfprobeFormatOutput
 from .ffmpeg import ffmpeg_run
-from .ffmpeg import ffprobe_format
 from .ffmpeg import ffprobe_video_size
-from .ffmpeg import measure_audio_band_levels
-from .ffmpeg import read_video_region_colors
 from .generate_device_settings import WidgetType
 from .generate_device_settings import uuid
 from .utils import FILES_DIR
@@ -34,17 +41,20 @@ ALERT_QUADRANT_COLORS = [
     Pixel(0, 0, 255),
     Pixel(255, 255, 0),
 ]
+ALERT_COLORS = np.array([[color.red, color.green, color.blue] for color in ALERT_QUADRANT_COLORS])
 ALERT_COLOR_TOLERANCE = 60
 ALERT_SOUND_FREQUENCY = 3000
-ALERT_SOUND_BANDWIDTH = 150
-ALERT_SOUND_BANDPASS_STAGES = 3
 ALERT_SOUND_DURATION = 0.4
-ALERT_SOUND_LEVEL_MARGIN = 12
 ALERT_SOUND_FLOOR_MARGIN = 30
 ALERT_SOUND_WINDOW = 0.1
 AUDIO_SEARCH_MARGIN = 10.0
+ALERT_ALIGNMENT_RESOLUTION = 0.25
 MAXIMUM_ALERT_OFFSET = 1.5
 VIDEO_SEARCH_MARGIN = 3.0
+# Decode all video instead of only the search windows around the alerts when decoding the
+# windows, from the keyframe before each to the keyframe after it, would take more than this
+# fraction of that. Both are decoded in keyframe segments in parallel.
+WHOLE_FILE_VIDEO_SCAN_COVERAGE = 0.5
 
 
 def alert_media_files() -> dict[str, Path]:
@@ -164,11 +174,30 @@ def measure_alert_synchronization(
 ) -> AlertSyncReport:
     width, height = ffprobe_video_size(path)
     crop = alert_crop(width, height, x, y)
-    audio_times = _find_audio_onsets(path, trigger_times)
-    with ThreadPoolExecutor(max_workers=8) as executor:
-        video_times = list(
-            executor.map(lambda audio_time: _find_video_onset(path, crop, audio_time), audio_times)
-        )
+    audio = AudioSignalAnalyzer()
+    format_output, keyframes = read_keyframes(path)
+    if _is_whole_file_scan_cheaper(format_output, keyframes, len(trigger_times)):
+        # The video is scanned while the audio is decoded.
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            region_colors_future = executor.submit(
+                read_region_colors, path, split_keyframes(format_output, keyframes), crop, 2, 2
+            )
+            decode_recording(path, [audio])
+            region_colors = region_colors_future.result()
+        audio_times = _find_audio_onsets(audio.signal, format_output, trigger_times)
+    else:
+        decode_recording(path, [audio])
+        audio_times = _find_audio_onsets(audio.signal, format_output, trigger_times)
+        windows = [
+            (
+                format_output.start_time + max(audio_time - VIDEO_SEARCH_MARGIN, 0),
+                format_output.start_time + audio_time + VIDEO_SEARCH_MARGIN,
+            )
+            for audio_time in audio_times
+            if audio_time is not None
+        ]
+        region_colors = read_region_colors(path, window_segments(keyframes, windows), crop, 2, 2)
+    video_times = _find_video_onsets(region_colors, format_output.start_time, audio_times)
     alerts = []
     missing = []
     for index, (trigger_time, audio_time, video_time) in enumerate(
@@ -183,15 +212,25 @@ def measure_alert_synchronization(
     return AlertSyncReport(path, alerts, missing)
 
 
-def _find_audio_onsets(path: Path, trigger_times: list[float]) -> list[float | None]:
-    probe = ffprobe_format(path)
+def _find_audio_onsets(
+    signal: AudioSignal | None,
+    format_output: FfprobeFormatOutput,
+    trigger_times: list[float],
+) -> list[float | None]:
+    if signal is None:
+        return _match_onsets([], trigger_times)
     onsets = []
-    for alert_sound in _find_alert_sounds(path, probe.start_time):
-        if alert_sound.time > probe.duration - ALERT_SOUND_DURATION:
+    for alert_sound in _find_alert_sounds(signal):
+        if alert_sound.time - format_output.start_time > format_output.duration - ALERT_SOUND_DURATION:
             continue
-        onset = _refine_alert_sound(path, alert_sound, probe.start_time)
+        onset = signal.tone_onset(
+            ALERT_SOUND_FREQUENCY,
+            alert_sound.level,
+            alert_sound.time - ALERT_SOUND_WINDOW,
+            alert_sound.time + ALERT_SOUND_WINDOW + ALERT_SOUND_DURATION,
+        )
         if onset is not None:
-            onsets.append(onset)
+            onsets.append(onset - format_output.start_time)
     return _match_onsets(onsets, trigger_times)
 
 
@@ -201,153 +240,60 @@ class AlertSound:
     level: float
 
 
-def _alert_sound_filters() -> list[str]:
-    return ALERT_SOUND_BANDPASS_STAGES * [
-        f"bandpass=f={ALERT_SOUND_FREQUENCY}:width_type=h:w={ALERT_SOUND_BANDWIDTH}"
-    ]
-
-
-def _find_alert_sounds(path: Path, start_time: float) -> list[AlertSound]:
-    levels = measure_audio_band_levels(
-        path,
-        _alert_sound_filters(),
-        ALERT_SOUND_WINDOW,
-        copy_timestamps=True,
-    )
+def _find_alert_sounds(signal: AudioSignal) -> list[AlertSound]:
+    times, levels = signal.tone_levels([ALERT_SOUND_FREQUENCY], ALERT_SOUND_WINDOW)
     if len(levels) == 0:
         return []
-    threshold = statistics.median(level.level for level in levels) + ALERT_SOUND_FLOOR_MARGIN
-    alert_sounds = []
-    run: list[AudioBandLevel] = []
-    for level in levels:
-        if level.level > threshold:
-            run.append(level)
-            continue
-        alert_sounds += _alert_sound(run, start_time)
-        run = []
-    return alert_sounds + _alert_sound(run, start_time)
-
-
-def _alert_sound(run: list[AudioBandLevel], start_time: float) -> list[AlertSound]:
-    if len(run) * ALERT_SOUND_WINDOW < ALERT_SOUND_DURATION / 2:
-        return []
-    return [AlertSound(run[0].time - start_time, max(level.level for level in run))]
-
-
-def _refine_alert_sound(path: Path, alert_sound: AlertSound, start_time: float) -> float | None:
-    onsets = detect_audio_onsets(
-        path,
-        alert_sound.level - ALERT_SOUND_LEVEL_MARGIN,
-        ALERT_SOUND_DURATION,
-        _alert_sound_filters(),
-        copy_timestamps=True,
-        start=max(alert_sound.time - 1, 0),
-        duration=1 + 2 * ALERT_SOUND_DURATION,
-    )
-    onsets = [
-        onset - start_time
-        for onset in sorted(onsets)
-        if abs(onset - start_time - alert_sound.time) < ALERT_SOUND_WINDOW + ALERT_SOUND_DURATION / 2
+    levels = levels[:, 0]
+    starts, ends = true_runs(levels > np.median(levels) + ALERT_SOUND_FLOOR_MARGIN)
+    long_enough = (ends - starts) * ALERT_SOUND_WINDOW >= ALERT_SOUND_DURATION / 2
+    return [
+        AlertSound(float(times[start]), float(levels[start:end].max()))
+        for start, end in zip(starts[long_enough].tolist(), ends[long_enough].tolist())
     ]
-    if len(onsets) == 0:
-        return None
-    return onsets[0]
 
 
 def _match_onsets(onsets: list[float], trigger_times: list[float]) -> list[float | None]:
-    onsets = sorted(onsets)
-    best: list[float | None] = [None] * len(trigger_times)
-    best_score = (0, 0.0)
-    for onset in onsets:
-        for trigger_time in trigger_times:
-            offset = onset - trigger_time
-            matched = _match_onsets_with_offset(onsets, trigger_times, offset)
-            score = _score_onsets(matched, trigger_times, offset)
-            if score > best_score:
-                best_score = score
-                best = matched
-    return best
-
-
-def _score_onsets(
-    matched: list[float | None],
-    trigger_times: list[float],
-    offset: float,
-) -> tuple[int, float]:
-    matches = 0
-    error = 0.0
-    for trigger_time, onset in zip(trigger_times, matched):
-        if onset is None:
-            continue
-        matches += 1
-        error += abs(onset - (trigger_time + offset))
-    return matches, -error
+    alignment = align_events(trigger_times, onsets, AUDIO_SEARCH_MARGIN, ALERT_ALIGNMENT_RESOLUTION)
+    alignment.log(LOGGER, "Alert sounds")
+    return alignment.matches
 
 
-def _match_onsets_with_offset(
-    onsets: list[float],
-    trigger_times: list[float],
-    offset: float,
-) -> list[float | None]:
-    matched: list[float | None] = []
-    for trigger_time in trigger_times:
-        nearest = _nearest(onsets, trigger_time + offset)
-        if nearest is None or abs(nearest - (trigger_time + offset)) > AUDIO_SEARCH_MARGIN:
-            matched.append(None)
-        else:
-            matched.append(nearest)
-    return matched
-
-
-def _nearest(values: list[float], value: float) -> float | None:
-    index = bisect.bisect_left(values, value)
-    candidates = values[max(index - 1, 0) : index + 1]
-    if len(candidates) == 0:
-        return None
-    return min(candidates, key=lambda candidate: abs(candidate - value))
-
-
-def _find_video_onset(path: Path, crop: Crop, audio_time: float | None) -> float | None:
-    if audio_time is None:
-        return None
-    frames = read_video_region_colors(
-        path,
-        crop,
-        2,
-        2,
-        max(audio_time - VIDEO_SEARCH_MARGIN, 0),
-        2 * VIDEO_SEARCH_MARGIN,
-    )
-    for frame in frames:
-        if _is_alert_image(frame.colors):
-            return frame.pts
-    return None
-
-
-def _is_alert_image(colors: list[Pixel]) -> bool:
-    if len(colors) != len(ALERT_QUADRANT_COLORS):
-        return False
-    return all(_is_color(color, expected) for color, expected in zip(colors, ALERT_QUADRANT_COLORS))
+def _is_whole_file_scan_cheaper(
+    format_output: FfprobeFormatOutput, keyframes: list[float], alert_count: int
+) -> bool:
+    keyframe_interval = format_output.duration / max(len(keyframes), 1)
+    window_duration = alert_count * (2 * VIDEO_SEARCH_MARGIN + keyframe_interval)
+    return window_duration > WHOLE_FILE_VIDEO_SCAN_COVERAGE * format_output.duration
 
 
-def _is_color(color: Pixel, expected: Pixel) -> bool:
-    return (
-        abs(color.red - expected.red) <= ALERT_COLOR_TOLERANCE
-        and abs(color.green - expected.green) <= ALERT_COLOR_TOLERANCE
-        and abs(color.blue - expected.blue) <= ALERT_COLOR_TOLERANCE
+def _find_video_onsets(
+    region_colors: RegionColorsAnalyzer,
+    start_time: float,
+    audio_times: list[float | None],
+) -> list[float | None]:
+    """The first alert frame in the search window of every audio onset, among all frames."""
+    alert_frames = np.all(
+        np.abs(region_colors.colors().astype(np.int16) - ALERT_COLORS) <= ALERT_COLOR_TOLERANCE,
+        axis=(1, 2),
     )
+    alert_times = np.asarray(region_colors.presentation_time_stamps)[alert_frames] - start_time
+    video_times: list[float | None] = []
+    for audio_time in audio_times:
+        if audio_time is None:
+            video_times.append(None)
+            continue
+        window_start = max(audio_time - VIDEO_SEARCH_MARGIN, 0)
+        index = int(np.searchsorted(alert_times, window_start))
+        if index < len(alert_times) and alert_times[index] < window_start + 2 * VIDEO_SEARCH_MARGIN:
+            video_times.append(float(alert_times[index]))
+        else:
+            video_times.append(None)
+    return video_times
 
 
 def _slope_per_hour(points: list[tuple[float, float]]) -> float:
-    if len(points) < 2:
-        return 0.0
-    mean_x = sum(x for x, _ in points) / len(points)
-    mean_y = sum(y for _, y in points) / len(points)
-    numerator = sum((x - mean_x) * (y - mean_y) for x, y in points)
-    denominator = sum((x - mean_x) ** 2 for x, _ in points)
-    if denominator == 0:
-        return 0.0
-    return 3600 * numerator / denominator
+    return 3600 * fit_line([x for x, _ in points], [y for _, y in points]).slope
 
 
 def _create_alert_image():
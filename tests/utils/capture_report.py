@@ -0,0 +1,234 @@
+import json
+import math
+from dataclasses import dataclass
+from dataclasses import field
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+from humanfriendly import format_size
+from humanfriendly import format_timespan
+
+from .monitor import log_table
+from .pacing import GAP_BIN_EDGES
+from .pacing import PACING_WINDOWS_MS
+from .pacing import PacingSeries
+from .srt_analysis import SrtSeries
+from .tcp_flow import TcpSeries
+
+REPORT_LEVEL_STEPS = [10, 60, 600]
+MAXIMUM_EMBEDDED_SECONDS = 4 * 3600
+TEMPLATE_FILE = Path(__file__).parent / "network_capture.html"
+
+
+@dataclass
+class Series:
+    name: str
+    slot: int
+    total_bytes: int
+    bitrates: list[float]
+
+    def maximum_mbps(self) -> float:
+        return max(self.bitrates, default=0)
+
+    def average_mbps(self, duration: float) -> float:
+        return 8 * self.total_bytes / duration / 1e6
+
+
+@dataclass
+class CaptureReport:
+    start_time: float
+    duration: float
+    files: list[Path]
+    series: list[Series]
+    total_slot: int
+    settings: dict[str, str]
+    srt_series: list[SrtSeries] = field(default_factory=list)
+    tcp_series: list[TcpSeries] = field(default_factory=list)
+    pacing_series: list[PacingSeries] = field(default_factory=list)
+
+    def log(self):
+        log_table(
+            "Captured bitrates",
+            ["Average Mbps", "Maximum Mbps", "Total"],
+            [
+                [
+                    series.name,
+                    f"{series.average_mbps(self.duration):.1f}",
+                    f"{series.maximum_mbps():.1f}",
+                    format_size(series.total_bytes),
+                ]
+                for series in self.series
+            ],
+        )
+        if self.srt_series:
+            log_table(
+                "Captured SRT",
+                ["Packets", "Retransmitted", "NAKed ranges", "RTT ms", "Link packets/s"],
+                [
+                    [
+                        series.name,
+                        str(sum(series.packets)),
+                        str(sum(series.retransmitted_packets)),
+                        str(sum(series.nak_ranges)),
+                        f"{nonzero_average(series.rtts):.1f}",
+                        f"{nonzero_average(series.link_capacities):.0f}",
+                    ]
+                    for series in self.srt_series
+                ],
+            )
+        if self.tcp_series:
+            log_table(
+                "Captured TCP",
+                ["Segments", "Retransmitted", "Out-of-order", "RTT ms"],
+                [
+                    [
+                        series.name,
+                        str(sum(series.segments)),
+                        str(sum(series.retransmitted_segments)),
+                        str(sum(series.out_of_order_segments)),
+                        f"{nonzero_average(series.rtts):.1f}",
+                    ]
+                    for series in self.tcp_series
+                ],
+            )
+        if self.pacing_series:
+            log_table("Captured pacing", self._pacing_columns(), self._pacing_rows())
+
+    def write_html(self, output: Path):
+        seconds_file = output.with_name(f"{output.stem}-seconds.js")
+        self.write_seconds(seconds_file)
+        embedded = self.duration <= MAXIMUM_EMBEDDED_SECONDS
+        data = {
+            "startTime": datetime.fromtimestamp(self.start_time).strftime("%Y-%m-%d %H:%M:%S"),
+            "duration": format_timespan(round(self.duration)),
+            "length": round(self.duration),
+            "files": ", ".join(file.name for file in self.files),
+            "secondsFile": seconds_file.name,
+            "totalSlot": self.total_slot,
+            "settings": [{"name": name, "value": value} for name, value in self.settings.items()],
+            "series": [
+                {
+                    "name": series.name,
+                    "slot": series.slot,
+                    "totalBytes": series.total_bytes,
+                    "levels": ([{"step": 1, "averages": series.bitrates}] if embedded else [])
+                    + [
+                        downsample(series.bitrates, step)
+                        for step in REPORT_LEVEL_STEPS
+                        if step < len(series.bitrates)
+                    ],
+                }
+                for series in self.series
+            ],
+            "protocolSeries": [
+                {
+                    "name": series.name,
+                    "slot": series.slot,
+                    "metric": metric,
+                    "levels": ([{"step": 1, "averages": values}] if embedded else [])
+                    + [downsample(values, step) for step in REPORT_LEVEL_STEPS if step < len(values)],
+                }
+                for series, metric, values in self._protocol_metrics()
+            ],
+            "pacing": {"columns": self._pacing_columns(), "rows": self._pacing_rows()},
+        }
+        template = TEMPLATE_FILE.read_text()
+        output.write_text(template.replace('"__CAPTURE_DATA__"', json.dumps(data)))
+
+    def write_seconds(self, output: Path):
+        data = {
+            "startTime": datetime.fromtimestamp(self.start_time).strftime("%Y-%m-%d %H:%M:%S"),
+            "series": [{"name": series.name, "bitrates": series.bitrates} for series in self.series],
+            "protocolSeries": [
+                {"name": series.name, "metric": metric, "values": values}
+                for series, metric, values in self._protocol_metrics()
+            ],
+        }
+        output.write_text(f"window.captureSeconds = {json.dumps(data)};\n")
+
+    def _protocol_metrics(self) -> list[tuple[SrtSeries | TcpSeries | PacingSeries, str, list]]:
+        protocol_series: list[SrtSeries | TcpSeries | PacingSeries] = [
+            *self.srt_series,
+            *self.tcp_series,
+            *self.pacing_series,
+        ]
+        return [
+            (series, metric, values)
+            for series in protocol_series
+            for metric, values in series.metrics().items()
+        ]
+
+    def _pacing_columns(self) -> list[str]:
+        return (
+            ["Packets", "Median gap ms", "99th percentile gap ms"]
+            + [f"Largest {window} ms burst" for window in PACING_WINDOWS_MS]
+            + [f"Peak to mean {window} ms" for window in PACING_WINDOWS_MS]
+        )
+
+    def _pacing_rows(self) -> list[list[str]]:
+        return [
+            [
+                series.name,
+                str(series.packets),
+                format_gap(series.gap_percentile(0.5)),
+                format_gap(series.gap_percentile(0.99)),
+                *[format_size(max(series.peak_bytes[window], default=0)) for window in PACING_WINDOWS_MS],
+                *[
+                    f"{nonzero_average(series.peak_to_mean_ratios[window]):.1f}"
+                    for window in PACING_WINDOWS_MS
+                ],
+            ]
+            for series in self.pacing_series
+        ]
+
+
+def format_gap(seconds: float) -> str:
+    return f"> {1000 * GAP_BIN_EDGES[-1]:g}" if math.isinf(seconds) else f"{1000 * seconds:.3g}"
+
+
+def nonzero_average(values: list[float]) -> float:
+    nonzero = [value for value in values if value]
+    return sum(nonzero) / len(nonzero) if nonzero else 0
+
+
+def downsample(bitrates: list[float], step: int) -> dict:
+    """Bucket averages and min/max envelopes of step seconds each, and the second picked in
+    each bucket by Largest-Triangle-Three-Buckets to draw the line through.
+    """
+    values = np.asarray(bitrates, dtype=np.float64)
+    count = math.ceil(len(values) / step)
+    padded = np.full(count * step, np.nan)
+    padded[: len(values)] = values
+    buckets = padded.reshape(count, step)
+    averages = np.nanmean(buckets, axis=1)
+    times = largest_triangle_three_buckets(values, averages, step)
+    return {
+        "step": step,
+        "averages": np.round(averages, 3).tolist(),
+        "minimums": np.nanmin(buckets, axis=1).tolist(),
+        "maximums": np.nanmax(buckets, axis=1).tolist(),
+        "times": times.tolist(),
+        "values": values[times].tolist(),
+    }
+
+
+def largest_triangle_three_buckets(values: np.ndarray, averages: np.ndarray, step: int) -> np.ndarray:
+    times = np.empty(len(averages), dtype=np.int64)
+    previous = 0
+    for bucket in range(len(averages)):
+        start = bucket * step
+        candidates = values[start : start + step]
+        if bucket + 1 < len(averages):
+            next_time = (bucket + 1) * step + (min(step, len(values) - start - step) - 1) / 2
+            next_value = averages[bucket + 1]
+        else:
+            next_time = len(values) - 1
+            next_value = values[-1]
+        areas = np.abs(
+            (previous - next_time) * (candidates - values[previous])
+            - (previous - np.arange(start, start + len(candidates))) * (next_value - values[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        times[bucket] = previous
+    return times
@@ -0,0 +1,950 @@
+import bisect
+import logging
+import math
+import os
+import tempfile
+from array import array
+from collections.abc import Callable
+from collections.abc import Iterator
+from concurrent.futures import Future
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from fractions import Fraction
+from functools import partial
+from itertools import repeat
+from pathlib import Path
+from typing import IO
+from typing import TypeVar
+
+import av
+import numpy as np
+from av.sidedata.sidedata import Type
+
+from .ffmpeg import BEEP_DURATION
+from .ffmpeg import BEEP_FREQUENCY
+from .ffmpeg import FfprobeAudioOutput
+from .ffmpeg import FfprobeFormatOutput
+from .ffmpeg import FfprobeVideoOutput
+from .ffmpeg import QrCode
+from .ffmpeg import VideoFrameTable
+from .ffmpeg import submit_qr_code
+from .utils import Crop
+from .utils import FrameCache
+from .utils import frame_hash
+
+LOGGER = logging.getLogger(__name__)
+# Like ffprobe, indexed by AVPictureType.
+PICTURE_TYPES = "?IPBSipb"
+# The defaults of ffmpeg's mpdecimate filter. A frame is a duplicate when no 8x8 block differs
+# by more than the high sum of absolute differences, and at most the fraction of blocks differ
+# by more than the low.
+DECIMATE_HIGH = 64 * 12
+DECIMATE_LOW = 64 * 5
+DECIMATE_FRACTION = 0.33
+DECIMATE_BAND_ROWS = 16
+# Like AVColorSpace and AVColorRange.
+COLORSPACE_BT709 = 1
+COLOR_RANGE_FULL = 2
+AUDIO_BAND_SAMPLE_RATE = 16000
+# Samples given to tone detectors at a time, to bound the memory used for long recordings.
+TONE_CHUNK_SIZE = 1 << 20
+# The sliding window in which tone onsets are refined, which trades noise for steepness.
+TONE_ONSET_WINDOW = 0.01
+# The amplitude of silence, at -120 dB.
+MINIMUM_AMPLITUDE = 1e-6
+BEEP_WINDOW = 0.05
+BEEP_LEVEL_MARGIN = 12
+# Like libltc, which ltcgen uses. The bits of a frame end with the sync word.
+LTC_BITS_PER_FRAME = 80
+LTC_SYNC_WORD = [0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 1]
+LTC_BREAK = 2
+# Samples closer to zero than this keep the polarity of the linear timecode signal.
+LTC_HYSTERESIS = 0.01
+# Recordings are split into segments of at least this many seconds for parallel analysis.
+MINIMUM_SEGMENT_DURATION = 60.0
+
+
+class FrameAnalyzer:
+    """Looks at every decoded frame of the first stream of its type in a recording."""
+
+    stream_type = "video"
+
+    def start(self, stream: av.stream.Stream):
+        pass
+
+    def add_frame(self, frame: av.frame.Frame):
+        raise NotImplementedError
+
+    def finish(self):
+        pass
+
+
+A = TypeVar("A", bound=FrameAnalyzer)
+
+
+class VideoFramesAnalyzer(FrameAnalyzer):
+    """The video stream and the presentation time stamps and picture types of its frames."""
+
+    def __init__(self):
+        self.output: FfprobeVideoOutput | None = None
+
+    def start(self, stream: av.stream.Stream):
+        assert isinstance(stream, av.VideoStream)
+        self.output = FfprobeVideoOutput(
+            codec=stream.codec_context.codec.canonical_name,
+            width=stream.codec_context.width,
+            height=stream.codec_context.height,
+            real_base_fps=stream.base_rate or None,
+            average_fps=stream.average_rate or None,
+            frames=VideoFrameTable(),
+        )
+
+    def add_frame(self, frame: av.frame.Frame):
+        assert isinstance(frame, av.VideoFrame) and self.output is not None
+        self.output.frames.append(frame_time(frame), PICTURE_TYPES[frame.pict_type])
+
+
+class AudioFramesAnalyzer(FrameAnalyzer):
+    """The audio stream and the presentation time stamps and sizes of its frames."""
+
+    stream_type = "audio"
+
+    def __init__(self):
+        self.output = FfprobeAudioOutput()
+
+    def start(self, stream: av.stream.Stream):
+        assert isinstance(stream, av.AudioStream)
+        codec_context = stream.codec_context
+        self.output = FfprobeAudioOutput(
+            codec=codec_context.codec.canonical_name,
+            profile=codec_context.profile or "",
+            sample_rate=codec_context.sample_rate,
+            channels=codec_context.channels,
+            channel_layout=codec_context.layout.name,
+            bit_rate=codec_context.bit_rate or 0,
+        )
+
+    def add_frame(self, frame: av.frame.Frame):
+        assert isinstance(frame, av.AudioFrame)
+        self.output.frames.append(frame_time(frame), len(frame.layout.channels), frame.samples)
+
+
+class UniqueFramesAnalyzer(FrameAnalyzer):
+    """Presentation time stamps of the frames that are not duplicates of the last unique frame
+    within a crop, like ffmpeg's mpdecimate filter.
+    """
+
+    def __init__(self, crop: Crop | None = None):
+        self.crop = crop
+        self.presentation_time_stamps: list[float] = []
+        # The planes of the last unique frame, and their hash.
+        self.reference: list[np.ndarray] | None = None
+        self.reference_hash = b""
+        self._differs: FrameCache[bool] = FrameCache()
+
+    def follow(self, previous: "UniqueFramesAnalyzer"):
+        """Continues after the frames given to another analyzer."""
+        self.reference = previous.reference
+        self.reference_hash = previous.reference_hash
+
+    def add_frame(self, frame: av.frame.Frame):
+        assert isinstance(frame, av.VideoFrame)
+        planes = cropped_planes(frame, self.crop)
+        planes_hash = frame_hash(*planes)
+        if self.reference is not None:
+            if planes_hash == self.reference_hash:
+                return
+            reference = self.reference
+            if not self._differs.get(
+                self.reference_hash + planes_hash,
+                lambda: any(plane_differs(plane, other) for plane, other in zip(planes, reference)),
+            ):
+                return
+        self.reference = [plane.copy() for plane in planes]
+        self.reference_hash = planes_hash
+        self.presentation_time_stamps.append(frame_time(frame))
+
+
+class RegionColorsAnalyzer(FrameAnalyzer):
+    """The RGB colors of a grid of regions of a crop of every frame, which are the average
+    colors of the regions, like ffmpeg's area scaling of the crop to the grid. They are kept
+    compact, as one byte per color component.
+    """
+
+    def __init__(self, crop: Crop, columns: int, rows: int):
+        self.crop = crop
+        self.columns = columns
+        self.rows = rows
+        self.presentation_time_stamps = array("d")
+        self._colors = bytearray()
+
+    def add_frame(self, frame: av.frame.Frame):
+        assert isinstance(frame, av.VideoFrame)
+        luma, blue, red = (
+            grid_means(plane, self.columns, self.rows) for plane in cropped_planes(frame, self.crop)
+        )
+        self._colors += yuv_to_rgb(luma, blue, red, frame.colorspace, frame.color_range).tobytes()
+        self.presentation_time_stamps.append(frame_time(frame))
+
+    def extend(self, other: "RegionColorsAnalyzer"):
+        """Appends the frames given to another analyzer, like of the next segment."""
+        self.presentation_time_stamps.extend(other.presentation_time_stamps)
+        self._colors += other.colors().tobytes()
+
+    def colors(self) -> np.ndarray:
+        """The colors of the regions of every frame, row by row, as red, green and blue."""
+        return np.frombuffer(self._colors, np.uint8).reshape(-1, self.columns * self.rows, 3)
+
+
+class QrCropsAnalyzer(FrameAnalyzer):
+    """Decodes the QR code in a crop of every frame, in a pool of processes."""
+
+    def __init__(self, crop: Crop):
+        self.crop = crop
+        self.qr_codes: list[QrCode] = []
+        self._executor: ProcessPoolExecutor | None = None
+        self._futures: list[Future[QrCode]] = []
+        self._pending: set[Future[QrCode]] = set()
+        self._cache: FrameCache[Future[QrCode]] = FrameCache()
+
+    def start(self, stream: av.stream.Stream):
+        self._executor = ProcessPoolExecutor()
+
+    def add_frame(self, frame: av.frame.Frame):
+        assert self._executor is not None
+        executor = self._executor
+        luma = np.ascontiguousarray(cropped_planes(frame, self.crop)[0])
+        self._futures.append(
+            self._cache.get(frame_hash(luma), lambda: submit_qr_code(executor, self._pending, luma))
+        )
+
+    def finish(self):
+        assert self._executor is not None
+        with self._executor:
+            self.qr_codes = [future.result() for future in self._futures]
+        LOGGER.debug(
+            "Decoded %d distinct QR code crops of %d frames.", self._cache.misses, len(self._futures)
+        )
+
+
+class AudioTimecodesAnalyzer(FrameAnalyzer):
+    """The SMPTE linear timecodes in the first channel of the audio stream, like ltcdump."""
+
+    stream_type = "audio"
+
+    def __init__(self, fps: int):
+        self.fps = fps
+        self.timecodes: list[AudioTimecode] = []
+        self._decoder: LtcDecoder | None = None
+        self._resampler: av.AudioResampler | None = None
+
+    def start(self, stream: av.stream.Stream):
+        assert isinstance(stream, av.AudioStream)
+        codec_context = stream.codec_context
+        self._decoder = LtcDecoder(codec_context.sample_rate, self.fps)
+        self._resampler = av.AudioResampler(
+            format="fltp", layout=codec_context.layout, rate=codec_context.sample_rate
+        )
+
+    def add_frame(self, frame: av.frame.Frame):
+        assert isinstance(frame, av.AudioFrame)
+        self._decode(frame)
+
+    def finish(self):
+        if self._resampler is not None:
+            self._decode(None)
+
+    def _decode(self, frame: av.AudioFrame | None):
+        assert self._resampler is not None and self._decoder is not None
+        for resampled in self._resampler.resample(frame):
+            self.timecodes += self._decoder.add(resampled.to_ndarray()[0], frame_time(resampled))
+
+
+@dataclass
+class AudioTimecode:
+    pts: float
+    hours: int
+    minutes: int
+    seconds: int
+    frame: int
+    # Whether the timecode does not follow the previous one.
+    discontinuity: bool
+
+
+class LtcDecoder:
+    """Decodes SMPTE linear timecode given in pieces of any size. It is biphase mark coded, so
+    the polarity changes at the start of every bit, and in its middle for ones. The intervals
+    between polarity changes are thereby either a full bit period for a zero, or half of one for
+    each half of a one. Intervals of other lengths, like in silence, break the stream of bits.
+    """
+
+    def __init__(self, sample_rate: int, fps: int):
+        self._sample_rate = sample_rate
+        self._fps = fps
+        self._period = sample_rate / (LTC_BITS_PER_FRAME * fps)
+        self._polarity = 0
+        self._previous: int | None = None
+        # Times of the polarity changes that end with a run of half periods not yet decoded.
+        self._changes = np.zeros(0)
+        # The last bits, which may be the start of a frame, with LTC_BREAK where the stream of
+        # bits breaks.
+        self._bits = np.zeros(0, np.uint8)
+        self._bit_times = np.zeros(0)
+
+    def add(self, samples: np.ndarray, start: float) -> list[AudioTimecode]:
+        """The timecodes of the frames completed by the samples, where the first sample is at
+        the start time.
+        """
+        self._changes = np.concatenate(
+            (self._changes, start + self._polarity_changes(samples) / self._sample_rate)
+        )
+        bits, bit_times = self._decode_bits()
+        self._bits = np.concatenate((self._bits, bits))
+        self._bit_times = np.concatenate((self._bit_times, bit_times))
+        if len(self._bits) < LTC_BITS_PER_FRAME:
+            return []
+        windows = np.lib.stride_tricks.sliding_window_view(self._bits, LTC_BITS_PER_FRAME)
+        starts = np.flatnonzero(
+            (windows[:, -len(LTC_SYNC_WORD) :] == LTC_SYNC_WORD).all(axis=1)
+            & (windows != LTC_BREAK).all(axis=1)
+        )
+        frames = windows[starts].astype(np.int64)
+        times = self._bit_times[starts].tolist()
+        self._bits = self._bits[1 - LTC_BITS_PER_FRAME :]
+        self._bit_times = self._bit_times[1 - LTC_BITS_PER_FRAME :]
+        timecodes = []
+        for time, hours, minutes, seconds, frame in zip(
+            times,
+            (_ltc_field(frames, 48, 4) + 10 * _ltc_field(frames, 56, 2)).tolist(),
+            (_ltc_field(frames, 32, 4) + 10 * _ltc_field(frames, 40, 3)).tolist(),
+            (_ltc_field(frames, 16, 4) + 10 * _ltc_field(frames, 24, 3)).tolist(),
+            (_ltc_field(frames, 0, 4) + 10 * _ltc_field(frames, 8, 2)).tolist(),
+        ):
+            number = ((60 * hours + minutes) * 60 + seconds) * self._fps + frame
+            discontinuity = self._previous is not None and number != (self._previous + 1) % (
+                86400 * self._fps
+            )
+            self._previous = number
+            timecodes.append(AudioTimecode(time, hours, minutes, seconds, frame, discontinuity))
+        return timecodes
+
+    def _polarity_changes(self, samples: np.ndarray) -> np.ndarray:
+        """The indexes of the samples where the polarity changes, with samples close to zero
+        keeping the polarity of the ones before them.
+        """
+        signs = np.where(np.abs(samples) > LTC_HYSTERESIS, np.sign(samples), 0).astype(np.int8)
+        indexes = np.arange(len(signs))
+        last = np.maximum.accumulate(np.where(signs != 0, indexes, -1))
+        polarities = np.where(last >= 0, signs[last], self._polarity)
+        previous = np.concatenate(([self._polarity], polarities[:-1]))
+        if len(polarities) > 0:
+            self._polarity = int(polarities[-1])
+        return np.flatnonzero((polarities != previous) & (previous != 0))
+
+    def _decode_bits(self) -> tuple[np.ndarray, np.ndarray]:
+        """The bits, and their start times, of the intervals between the polarity changes up to
+        the last one that is not half a period.
+        """
+        periods = np.diff(self._changes) / self._period * self._sample_rate
+        halves = (periods >= 0.25) & (periods < 0.75)
+        ends = np.flatnonzero(~halves)
+        if len(ends) == 0:
+            return np.zeros(0, np.uint8), np.zeros(0)
+        count = int(ends[-1]) + 1
+        periods = periods[:count]
+        halves = halves[:count]
+        times = self._changes[:count]
+        self._changes = self._changes[count:]
+        indexes = np.arange(count)
+        run_starts = np.maximum.accumulate(np.where(halves, -1, indexes)) + 1
+        run_ends = np.minimum.accumulate(np.where(halves, count, indexes)[::-1])[::-1]
+        # Both halves of a one are in a run of half periods, so odd runs are errors, which
+        # break the stream before the interval after them.
+        odd = (run_ends - run_starts) % 2 == 1
+        ones = halves & ~odd & ((indexes - run_starts) % 2 == 0)
+        zeros = ~halves & (periods >= 0.75) & (periods < 1.5)
+        breaks = ~halves & ~zeros
+        breaks[run_ends[halves & odd]] = True
+        # A break comes before the zero of the same interval.
+        order = np.concatenate((2 * indexes[breaks], 2 * indexes[ones | zeros] + 1))
+        bits = np.concatenate(
+            (
+                np.full(np.count_nonzero(breaks), LTC_BREAK, np.uint8),
+                ones[ones | zeros].astype(np.uint8),
+            )
+        )
+        bit_times = np.concatenate((times[breaks], times[ones | zeros]))
+        sorted_order = np.argsort(order, kind="stable")
+        return bits[sorted_order], bit_times[sorted_order]
+
+
+def _ltc_field(frames: np.ndarray, first: int, count: int) -> np.ndarray:
+    return frames[:, first : first + count] @ (1 << np.arange(count))
+
+
+class ToneDetector:
+    """The levels of a few frequencies in consecutive blocks of a signal, which is given in
+    pieces of any size, like a bank of Goertzel filters. All blocks of a piece are correlated
+    with Hann windowed tones at once.
+    """
+
+    def __init__(self, frequencies: list[float], sample_rate: int, block_size: int):
+        window = np.hanning(block_size)
+        tones = np.exp(-2j * np.pi * np.outer(frequencies, np.arange(block_size)) / sample_rate)
+        self._tones = (window * tones / window.sum()).T
+        self._block_size = block_size
+        self._pending = np.zeros(0, np.float32)
+
+    def add(self, samples: np.ndarray) -> np.ndarray:
+        """The RMS levels in dB of the blocks completed by the samples, one column per
+        frequency.
+        """
+        samples = np.concatenate((self._pending, samples))
+        count = len(samples) // self._block_size
+        self._pending = samples[count * self._block_size :]
+        blocks = samples[: count * self._block_size].reshape(count, self._block_size)
+        amplitudes = 2 * np.abs(blocks @ self._tones)
+        return 20 * np.log10(np.maximum(amplitudes / math.sqrt(2), MINIMUM_AMPLITUDE))
+
+
+@dataclass
+class AudioSignal:
+    """A mono audio signal, with the presentation time stamp of its first sample."""
+
+    samples: np.ndarray
+    sample_rate: int
+    start: float
+
+    def time(self, index: int | float | np.ndarray):
+        return self.start + index / self.sample_rate
+
+    def index(self, time: float) -> int:
+        return min(max(round((time - self.start) * self.sample_rate), 0), len(self.samples))
+
+    def tone_levels(self, frequencies: list[float], window: float) -> tuple[np.ndarray, np.ndarray]:
+        """The start times of consecutive windows and the RMS levels in dB of the frequencies in
+        them, one column per frequency.
+        """
+        size = round(window * self.sample_rate)
+        detector = ToneDetector(frequencies, self.sample_rate, size)
+        levels = np.concatenate(
+            [
+                np.zeros((0, len(frequencies))),
+                *[
+                    detector.add(self.samples[first : first + TONE_CHUNK_SIZE])
+                    for first in range(0, len(self.samples), TONE_CHUNK_SIZE)
+                ],
+            ]
+        )
+        return self.time(np.arange(len(levels)) * size), levels
+
+    def tone_onset(self, frequency: float, level: float, start: float, end: float) -> float | None:
+        """The time where a tone of the RMS level in dB starts within a range, to a fraction
+        of a millisecond. It is where the amplitude of the frequency in a sliding window rises
+        to half of the tone's before the loudest window of the range.
+        """
+        size = round(TONE_ONSET_WINDOW * self.sample_rate)
+        first = self.index(start)
+        indexes = np.arange(first, self.index(end))
+        demodulated = self.samples[first : first + len(indexes)] * np.exp(
+            -2j * np.pi * frequency * indexes / self.sample_rate
+        )
+        sums = np.concatenate(([0], np.cumsum(demodulated)))
+        amplitudes = 2 * np.abs(sums[size:] - sums[:-size]) / size
+        if len(amplitudes) == 0:
+            return None
+        threshold = 10 ** (level / 20) * math.sqrt(2) / 2
+        loudest = int(np.argmax(amplitudes))
+        quiet = np.flatnonzero(amplitudes[:loudest] < threshold)
+        if amplitudes[loudest] < threshold or len(quiet) == 0:
+            return None
+        return float(self.time(first + quiet[-1] + 1 + size / 2))
+
+
+def true_runs(mask: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """The start and end indexes of the runs of true values."""
+    if len(mask) == 0:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64)
+    changes = np.flatnonzero(mask[1:] != mask[:-1]) + 1
+    starts = np.concatenate(([0], changes))
+    ends = np.concatenate((changes, [len(mask)]))
+    return starts[mask[starts]], ends[mask[starts]]
+
+
+class AudioSignalAnalyzer(FrameAnalyzer):
+    """Resamples the audio stream into a mono signal of 32 bit floats, which is memory mapped
+    from a temporary file, as recordings may be hours long. Gaps in the stream are filled with
+    silence. Tones are found in it by the ToneDetector instead of band-pass filters.
+    """
+
+    stream_type = "audio"
+
+    def __init__(self, sample_rate: int = AUDIO_BAND_SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self.signal: AudioSignal | None = None
+        self._graph: av.filter.Graph | None = None
+        self._file: IO[bytes] | None = None
+        self._start: float | None = None
+        self._length = 0
+
+    def start(self, stream: av.stream.Stream):
+        assert isinstance(stream, av.AudioStream)
+        self._graph = av.filter.Graph()
+        self._graph.link_nodes(
+            self._graph.add_abuffer(template=stream),
+            self._graph.add(
+                "aformat", f"sample_fmts=flt|fltp:channel_layouts=mono:sample_rates={self.sample_rate}"
+            ),
+            self._graph.add("abuffersink"),
+        ).configure()
+        self._file = tempfile.TemporaryFile()
+
+    def add_frame(self, frame: av.frame.Frame):
+        assert isinstance(frame, av.AudioFrame) and self._graph is not None
+        self._graph.push(frame)
+        self._pull()
+
+    def finish(self):
+        if self._graph is None or self._file is None:
+            return
+        self._graph.push(None)
+        self._pull()
+        with self._file:
+            if self._length == 0:
+                samples = np.zeros(0, np.float32)
+            else:
+                samples = np.memmap(self._file, np.float32, "r", shape=(self._length,))
+        self.signal = AudioSignal(samples, self.sample_rate, self._start or 0.0)
+
+    def _pull(self):
+        assert self._graph is not None and self._file is not None
+        while True:
+            try:
+                frame = self._graph.pull()
+            except (av.error.BlockingIOError, av.error.EOFError):
+                return
+            assert isinstance(frame, av.AudioFrame)
+            if self._start is None:
+                self._start = frame_time(frame)
+            gap = round((frame_time(frame) - self._start) * self.sample_rate) - self._length
+            if gap > 0:
+                self._file.write(np.zeros(gap, np.float32).tobytes())
+                self._length += gap
+            samples = frame.to_ndarray()[0].astype(np.float32, copy=False)
+            self._file.write(samples.tobytes())
+            self._length += len(samples)
+
+
+def detect_beeps(path: Path) -> list[float]:
+    """The start times of the beeps of the audio test stream in a recording, after at least
+    twice their duration of quiet.
+    """
+    analyzer = AudioSignalAnalyzer()
+    format_output = decode_recording(path, [analyzer])
+    signal = analyzer.signal
+    if signal is None:
+        return []
+    times, levels = signal.tone_levels([BEEP_FREQUENCY], BEEP_WINDOW)
+    if len(levels) == 0:
+        return []
+    levels = levels[:, 0]
+    starts, ends = true_runs(levels > levels.max() - BEEP_LEVEL_MARGIN)
+    quiet = (starts - np.concatenate(([0], ends[:-1]))) * BEEP_WINDOW >= 2 * BEEP_DURATION
+    beeps = []
+    for start, end in zip(starts[quiet].tolist(), ends[quiet].tolist()):
+        onset = signal.tone_onset(
+            BEEP_FREQUENCY,
+            float(levels[start:end].max()),
+            times[start] - BEEP_WINDOW,
+            times[start] + BEEP_WINDOW + BEEP_DURATION,
+        )
+        if onset is not None and onset - format_output.start_time < format_output.duration - BEEP_DURATION:
+            beeps.append(onset - format_output.start_time)
+    return beeps
+
+
+def decode_recording(path: Path, analyzers: list[FrameAnalyzer]) -> FfprobeFormatOutput:
+    """Demuxes and decodes the first video and audio streams of a recording once, and gives
+    every frame to the analyzers of its stream type.
+    """
+    with av.open(str(path)) as container:
+        streams: dict[int, tuple[av.VideoStream | av.AudioStream, list[FrameAnalyzer]]] = {}
+        for stream_type in dict.fromkeys(analyzer.stream_type for analyzer in analyzers):
+            candidates = container.streams.video if stream_type == "video" else container.streams.audio
+            if len(candidates) == 0:
+                continue
+            stream = candidates[0]
+            stream.codec_context.thread_type = "AUTO"
+            streams[stream.index] = (
+                stream,
+                [analyzer for analyzer in analyzers if analyzer.stream_type == stream_type],
+            )
+            for analyzer in streams[stream.index][1]:
+                analyzer.start(stream)
+        for packet in container.demux([stream for stream, _ in streams.values()]):
+            stream, stream_analyzers = streams[packet.stream.index]
+            for frame in _decode(path, stream, packet):
+                for analyzer in stream_analyzers:
+                    analyzer.add_frame(frame)
+        for _, stream_analyzers in streams.values():
+            for analyzer in stream_analyzers:
+                analyzer.finish()
+        return FfprobeFormatOutput(
+            duration=(container.duration or 0) / av.time_base,
+            start_time=(container.start_time or 0) / av.time_base,
+        )
+
+
+@dataclass
+class Segment:
+    """The video frames of a recording with presentation time stamps from the start keyframe,
+    inclusive, to the end keyframe. Decoding starts at the keyframe before the start keyframe,
+    as seeking in some containers, like MPEG-TS, lands on the first packet decoded after the
+    time. Leading frames of the end keyframe, that reference frames before it, are decoded with
+    the segment.
+    """
+
+    seek: float | None
+    start: float | None
+    end: float | None
+
+
+def read_keyframes(path: Path) -> tuple[FfprobeFormatOutput, list[float]]:
+    """The sorted keyframe times of the video stream of a recording, found by demuxing only."""
+    with av.open(str(path)) as container:
+        format_output = FfprobeFormatOutput(
+            duration=(container.duration or 0) / av.time_base,
+            start_time=(container.start_time or 0) / av.time_base,
+        )
+        if len(container.streams.video) == 0:
+            return format_output, []
+        stream = container.streams.video[0]
+        keyframes = sorted(
+            time
+            for packet in container.demux(stream)
+            if packet.is_keyframe and (time := packet_time(packet)) is not None
+        )
+    return format_output, keyframes
+
+
+def split_recording(path: Path) -> tuple[FfprobeFormatOutput, list[Segment]]:
+    """Splits the video stream of a recording at keyframes into segments of similar durations,
+    a few per processor, to be analyzed in parallel.
+    """
+    format_output, keyframes = read_keyframes(path)
+    return format_output, split_keyframes(format_output, keyframes)
+
+
+def split_keyframes(format_output: FfprobeFormatOutput, keyframes: list[float]) -> list[Segment]:
+    duration = format_output.duration
+    count = max(
+        1, math.ceil(duration / max(MINIMUM_SEGMENT_DURATION, duration / (4 * (os.cpu_count() or 1))))
+    )
+    positions = [0]
+    for index in range(1, count):
+        position = bisect.bisect_left(keyframes, format_output.start_time + index * duration / count)
+        if positions[-1] < position < len(keyframes):
+            positions.append(position)
+    segments = [Segment(None, None, None)]
+    for position in positions[1:]:
+        segments[-1].end = keyframes[position]
+        segments.append(Segment(keyframes[position - 1], keyframes[position], None))
+    return segments
+
+
+def window_segments(keyframes: list[float], windows: list[tuple[float, float]]) -> list[Segment]:
+    """The segments from the keyframe at or before the start of every time window to the
+    keyframe after its end, with overlapping segments joined.
+    """
+    segments: list[Segment] = []
+    for start, end in sorted(windows):
+        first = bisect.bisect_right(keyframes, start) - 1
+        last = bisect.bisect_right(keyframes, end)
+        end_keyframe = keyframes[last] if last < len(keyframes) else None
+        if segments and (segments[-1].end is None or first < 0 or keyframes[first] <= segments[-1].end):
+            if segments[-1].end is not None:
+                segments[-1].end = None if end_keyframe is None else max(segments[-1].end, end_keyframe)
+            continue
+        if first > 0:
+            segments.append(Segment(keyframes[first - 1], keyframes[first], end_keyframe))
+        else:
+            segments.append(Segment(None, None, end_keyframe))
+    return segments
+
+
+def segment_frames(
+    path: Path,
+    container: av.container.InputContainer,
+    stream: av.VideoStream,
+    segment: Segment,
+) -> Iterator[av.VideoFrame]:
+    """The decoded frames of a segment, in presentation order."""
+    if segment.seek is not None:
+        assert stream.time_base is not None
+        container.seek(round(segment.seek / stream.time_base), stream=stream)
+    is_first = True
+    for packet in container.demux(stream):
+        # Frames before the keyframe after the end keyframe may still be leading frames of it.
+        time = packet_time(packet)
+        is_last = segment.end is not None and packet.is_keyframe and time is not None and time > segment.end
+        for frame in _decode(path, stream, None if is_last else packet):
+            assert isinstance(frame, av.VideoFrame)
+            pts = frame_time(frame)
+            if segment.start is not None and pts < segment.start:
+                continue
+            if segment.end is not None and pts >= segment.end:
+                continue
+            if is_first and segment.start is not None and pts != segment.start:
+                raise Exception(f"Decoding of {path} did not start at the keyframe at {segment.start}.")
+            is_first = False
+            yield frame
+        if is_last:
+            return
+
+
+def analyze_segment(path: Path, segment: Segment, create_analyzer: Callable[[], A]) -> A:
+    """Gives the frames of a segment to a new analyzer, in a process of its own."""
+    analyzer = create_analyzer()
+    with av.open(str(path)) as container:
+        stream = container.streams.video[0]
+        stream.codec_context.thread_type = "AUTO"
+        analyzer.start(stream)
+        for frame in segment_frames(path, container, stream, segment):
+            analyzer.add_frame(frame)
+        analyzer.finish()
+    return analyzer
+
+
+def analyze_segments(path: Path, segments: list[Segment], create_analyzer: Callable[[], A]) -> list[A]:
+    """Analyzes the segments of a recording in a pool of processes, with an analyzer each."""
+    if len(segments) == 1:
+        return [analyze_segment(path, segments[0], create_analyzer)]
+    with ProcessPoolExecutor() as executor:
+        return list(executor.map(analyze_segment, repeat(path), segments, repeat(create_analyzer)))
+
+
+def read_region_colors(
+    path: Path, segments: list[Segment], crop: Crop, columns: int, rows: int
+) -> RegionColorsAnalyzer:
+    """The region colors of every frame of the segments of a recording, analyzed in parallel."""
+    analyzers = analyze_segments(path, segments, partial(RegionColorsAnalyzer, crop, columns, rows))
+    if len(analyzers) == 0:
+        return RegionColorsAnalyzer(crop, columns, rows)
+    for analyzer in analyzers[1:]:
+        analyzers[0].extend(analyzer)
+    return analyzers[0]
+
+
+def read_unique_frame_presentation_time_stamps(path: Path, crop: Crop | None = None) -> list[float]:
+    """Like ffmpeg's mpdecimate filter, with the time stamps relative to the start of the
+    recording like ffmpeg's output. Long recordings are analyzed in segments in parallel.
+    """
+    format_output, segments = split_recording(path)
+    analyzers = analyze_segments(path, segments, partial(UniqueFramesAnalyzer, crop))
+    presentation_time_stamps: list[float] = []
+    previous: UniqueFramesAnalyzer | None = None
+    for segment, analyzer in zip(segments, analyzers):
+        if previous is not None:
+            analyzer = _join_unique_frames(path, segment, previous, analyzer)
+        presentation_time_stamps += analyzer.presentation_time_stamps
+        previous = analyzer
+    return [pts - format_output.start_time for pts in presentation_time_stamps]
+
+
+def _join_unique_frames(
+    path: Path,
+    segment: Segment,
+    previous: UniqueFramesAnalyzer,
+    analyzer: UniqueFramesAnalyzer,
+) -> UniqueFramesAnalyzer:
+    """The unique frames of a segment following the unique frames before it. The segment was
+    analyzed without the last unique frame before it, so its frames are compared with that
+    frame again until one is unique in both analyses. They agree from there on.
+    """
+    joined = UniqueFramesAnalyzer(analyzer.crop)
+    joined.follow(previous)
+    unique = set(analyzer.presentation_time_stamps)
+    with av.open(str(path)) as container:
+        stream = container.streams.video[0]
+        stream.codec_context.thread_type = "AUTO"
+        for frame in segment_frames(path, container, stream, segment):
+            count = len(joined.presentation_time_stamps)
+            joined.add_frame(frame)
+            if len(joined.presentation_time_stamps) > count and frame_time(frame) in unique:
+                analyzer.presentation_time_stamps = joined.presentation_time_stamps + [
+                    pts for pts in analyzer.presentation_time_stamps if pts > frame_time(frame)
+                ]
+                return analyzer
+    return joined
+
+
+def _decode(path: Path, stream: av.VideoStream | av.AudioStream, packet: av.Packet | None) -> list:
+    """The frames decoded from a packet, or the remaining frames without one."""
+    try:
+        frames = stream.decode(packet)
+    except av.error.InvalidDataError as error:
+        LOGGER.debug("Skipping a packet that failed to decode in %s. %s", path, error)
+        return []
+    if packet is None:
+        # Without a packet, the frames have no time base to get their time from.
+        for frame in frames:
+            frame.time_base = stream.time_base
+    return frames
+
+
+@dataclass
+class VideoTimecode:
+    pts: float
+    hours: int
+    minutes: int
+    seconds: int
+    frame: int
+
+    def time_of_day(self, fps: int) -> float:
+        return 3600 * self.hours + 60 * self.minutes + self.seconds + self.frame / fps
+
+
+def read_video_timecodes(path: Path) -> Iterator[VideoTimecode | None]:
+    """The SMPTE 12-1 timecode of every frame of the video stream, if any, one frame at a time.
+    The decoders export the timecodes of SEI messages as frame side data.
+    """
+    with av.open(str(path)) as container:
+        stream = container.streams.video[0]
+        stream.codec_context.thread_type = "AUTO"
+        for packet in container.demux(stream):
+            for frame in _decode(path, stream, packet):
+                side_data = frame.side_data.get(Type.S12M_TIMECODE)
+                if side_data is None:
+                    yield None
+                    continue
+                timecodes = np.frombuffer(memoryview(side_data), np.uint32)
+                yield parse_smpte_timecode(frame_time(frame), int(timecodes[1]), stream.average_rate)
+
+
+def parse_smpte_timecode(pts: float, timecode: int, rate: Fraction | None) -> VideoTimecode:
+    """Like av_timecode_make_smpte_tc_string2() in FFmpeg, which formats them for ffprobe."""
+    number = _bcd(timecode >> 24 & 0x3F)
+    if rate is not None and rate > 30:
+        number = 2 * number + (timecode >> (7 if rate == 50 else 23) & 1)
+    return VideoTimecode(
+        pts,
+        _bcd(timecode & 0x3F),
+        _bcd(timecode >> 8 & 0x7F),
+        _bcd(timecode >> 16 & 0x7F),
+        number,
+    )
+
+
+def _bcd(value: int) -> int:
+    return 10 * (value >> 4) + (value & 0xF)
+
+
+def frame_time(frame: av.frame.Frame) -> float:
+    if frame.time is None:
+        raise Exception("A decoded frame has no presentation time stamp.")
+    return frame.time
+
+
+def packet_time(packet: av.Packet) -> float | None:
+    if packet.pts is None or packet.time_base is None:
+        return None
+    return float(packet.pts * packet.time_base)
+
+
+def cropped_planes(frame: av.frame.Frame, crop: Crop | None) -> list[np.ndarray]:
+    """The Y, U and V planes of a crop of a frame, with the crop position rounded down to even
+    like ffmpeg's crop filter.
+    """
+    assert isinstance(frame, av.VideoFrame)
+    if frame.format.name != "yuv420p":
+        frame = frame.reformat(format="yuv420p")
+    planes = [
+        np.frombuffer(memoryview(plane), np.uint8).reshape(plane.height, plane.line_size)[:, : plane.width]
+        for plane in frame.planes
+    ]
+    if crop is None:
+        return planes
+    x = crop.x & ~1
+    y = crop.y & ~1
+    return [
+        planes[0][y : y + crop.height, x : x + crop.width],
+        *[
+            plane[y // 2 : y // 2 + (crop.height + 1) // 2, x // 2 : x // 2 + (crop.width + 1) // 2]
+            for plane in planes[1:]
+        ],
+    ]
+
+
+def grid_means(plane: np.ndarray, columns: int, rows: int) -> np.ndarray:
+    """The mean values of a grid of regions of a plane."""
+    height, width = plane.shape
+    row_edges = np.arange(rows) * height // rows
+    column_edges = np.arange(columns) * width // columns
+    sums = np.add.reduceat(np.add.reduceat(plane, row_edges, axis=0, dtype=np.uint32), column_edges, axis=1)
+    counts = np.outer(np.diff(row_edges, append=height), np.diff(column_edges, append=width))
+    return sums / counts
+
+
+def yuv_to_rgb(
+    luma: np.ndarray,
+    blue: np.ndarray,
+    red: np.ndarray,
+    colorspace: int,
+    color_range: int,
+) -> np.ndarray:
+    """Converts YCbCr to RGB like swscale, with BT.709 coefficients for BT.709 frames and BT.601
+    for others, including unspecified.
+    """
+    red_weight, blue_weight = (0.2126, 0.0722) if colorspace == COLORSPACE_BT709 else (0.299, 0.114)
+    green_weight = 1 - red_weight - blue_weight
+    if color_range == COLOR_RANGE_FULL:
+        luma = luma.astype(np.float64)
+        blue = blue - 128.0
+        red = red - 128.0
+    else:
+        luma = (luma - 16.0) * 255 / 219
+        blue = (blue - 128.0) * 255 / 224
+        red = (red - 128.0) * 255 / 224
+    rgb = np.stack(
+        [
+            luma + 2 * (1 - red_weight) * red,
+            luma
+            - 2 * blue_weight * (1 - blue_weight) / green_weight * blue
+            - 2 * red_weight * (1 - red_weight) / green_weight * red,
+            luma + 2 * (1 - blue_weight) * blue,
+        ],
+        axis=-1,
+    )
+    return np.clip(np.rint(rgb), 0, 255).astype(np.uint8)
+
+
+def plane_differs(plane: np.ndarray, reference: np.ndarray) -> bool:
+    """Whether a plane differs from the reference according to mpdecimate, which sums the
+    absolute differences of 8x8 blocks every 4 pixels, skipping the first 8 columns.
+    """
+    height, width = plane.shape
+    threshold = int((width // 16) * (height // 16) * DECIMATE_FRACTION)
+    block_rows = (height - 8) // 4 + 1
+    block_columns = (width - 8) // 4 + 1
+    if block_rows <= 0 or block_columns <= 2:
+        return False
+    differing = 0
+    # Bands of blocks are compared in turn, as most frames differ already in the first band.
+    for first in range(0, block_rows, DECIMATE_BAND_ROWS):
+        last = min(first + DECIMATE_BAND_ROWS, block_rows)
+        rows = slice(4 * first, 4 * (last + 1))
+        columns = slice(0, 4 * (block_columns + 1))
+        current = plane[rows, columns]
+        previous = reference[rows, columns]
+        differences = (np.maximum(current, previous) - np.minimum(current, previous)).astype(np.uint16)
+        # Sums of 4x4 quarters, and of the four quarters of each 8x8 block.
+        quarters = differences[:, 0::4] + differences[:, 1::4] + differences[:, 2::4] + differences[:, 3::4]
+        quarters = quarters[0::4] + quarters[1::4] + quarters[2::4] + quarters[3::4]
+        sums = quarters[:-1, :-1] + quarters[1:, :-1] + quarters[:-1, 1:] + quarters[1:, 1:]
+        sums = sums[:, 2:]
+        if (sums > DECIMATE_HIGH).any():
+            return True
+        differing += int(np.count_nonzero(sums > DECIMATE_LOW))
+        if differing > threshold:
+            return True
+    return False
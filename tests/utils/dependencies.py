@@ -15,7 +15,6 @@ def check_dependencies():
         "qrtool",
         "mediamtx",
         "ltcgen",
-        "ltcdump",
         "openssl",
         "ssh",
         "lsof",
@@ -1,24 +1,41 @@
 import functools
+import hashlib
 import json
 import logging
 import math
+import os
+import queue
 import re
 import shutil
 import subprocess
+import tempfile
+import threading
 import time
-from concurrent.futures import ThreadPoolExecutor
+from array import array
+from collections.abc import Iterator
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import Executor
+from concurrent.futures import Future
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import wait
 from dataclasses import dataclass
 from dataclasses import field
 from enum import StrEnum
 from fractions import Fraction
 from pathlib import Path
+from typing import IO
 from urllib.parse import urlsplit
 
+import numpy as np
+import zxingcpp
+
 from .process import ManagedProcess
 from .utils import FILES_DIR
 from .utils import Crop
+from .utils import FrameCache
 from .utils import Image
 from .utils import Pixel
+from .utils import frame_hash
 from .utils import wait_until
 
 LOGGER = logging.getLogger(__name__)
@@ -26,14 +43,16 @@ FFMPEG_COMMAND = ["ffmpeg", "-hide_banner", "-nostdin", "-nostats", "-y"]
 RE_VOLUME_DETECT = re.compile(r"(n_samples|mean_volume|max_volume): (-?[\d.]+|-?inf)")
 RE_SILENCE_DETECT = re.compile(r"silence_(start|end): (-?[\d.]+)")
 RE_SHOWINFO_PTS = re.compile(r"^\[Parsed_showinfo.*? pts_time:(\S+)", re.MULTILINE)
-RE_METADATA_TIME = re.compile(r"^\[Parsed_ametadata.*? pts_time:(\S+)", re.MULTILINE)
-RE_ASTATS_RMS_LEVEL = re.compile(r"^\[Parsed_ametadata.*? lavfi\.astats\.(\d)\.RMS_level=(\S+)", re.MULTILINE)
-AUDIO_BAND_SAMPLE_RATE = 16000
 BEEP_FREQUENCY = 3000
-BEEP_BANDWIDTH = 400
 BEEP_DURATION = 0.4
 BEEP_INTERVAL = 2
-BEEP_LEVEL_MARGIN = 12
+# Outputs of ffprobe and ffmpeg analyses are cached in this directory next to the analyzed files,
+# where the least recently used are removed beyond the size.
+ANALYSIS_CACHE_DIRECTORY = "analysis-cache"
+ANALYSIS_CACHE_SIZE = 512 * 1024 * 1024
+ANALYSIS_CACHE_PATH = "{path}"
+# Images waiting to be decoded are held in memory, so the number of them is bounded.
+MAXIMUM_PENDING_QR_CODES = 64
 
 
 class FfmpegVideoCodec(StrEnum):
@@ -81,6 +100,78 @@ def _run_binary(command: list[str]) -> bytes:
     return _run_logged(command, False).stdout
 
 
+@functools.cache
+def tool_version(tool: str) -> str:
+    return _run([tool, "-version"]).stdout.split("\n", 1)[0]
+
+
+def analysis_cache_file(path: Path, command: list[str]) -> Path:
+    """The file caching the output of an analysis command, in a directory next to the analyzed
+    file. It is keyed by the command, the identity of the file and the version of the tool.
+    """
+    stat = path.stat()
+    key = json.dumps(
+        [
+            [ANALYSIS_CACHE_PATH if argument == str(path) else argument for argument in command],
+            stat.st_size,
+            stat.st_mtime_ns,
+            stat.st_ino,
+            tool_version(command[0]),
+        ]
+    )
+    return path.parent / ANALYSIS_CACHE_DIRECTORY / hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+
+def _run_cached(path: Path, command: list[str], stderr: bool = False) -> Path:
+    """Runs an analysis command of a file, unless cached, and returns the cache file with its
+    standard output, or standard error.
+    """
+    cache_file = analysis_cache_file(path, command)
+    try:
+        os.utime(cache_file)
+        LOGGER.debug("Cached command: %s", " ".join(command))
+        return cache_file
+    except FileNotFoundError:
+        pass
+    started = time.monotonic()
+    with tempfile.TemporaryFile() as output, tempfile.TemporaryFile() as errors:
+        try:
+            returncode = subprocess.run(command, stdout=output, stderr=errors, check=False).returncode
+        finally:
+            LOGGER.debug("Command (%.3f s): %s", time.monotonic() - started, " ".join(command))
+        if returncode != 0:
+            errors.seek(0)
+            raise subprocess.CalledProcessError(
+                returncode, command, stderr=errors.read().decode("utf-8", "replace")
+            )
+        kept = errors if stderr else output
+        kept.seek(0)
+        cache_file.parent.mkdir(exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=cache_file.parent, delete=False) as cached:
+            shutil.copyfileobj(kept, cached)
+    os.replace(cached.name, cache_file)
+    evict_analysis_cache(cache_file.parent, cache_file)
+    return cache_file
+
+
+def evict_analysis_cache(directory: Path, kept: Path):
+    """Removes the least recently used cache files beyond the size of the cache, but never the
+    kept file, which is about to be read even if it is larger than the cache.
+    """
+    files = []
+    for file in directory.iterdir():
+        try:
+            stat = file.stat()
+        except FileNotFoundError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, file))
+    total_size = 0
+    for _, size, file in sorted(files, reverse=True):
+        total_size += size
+        if total_size > ANALYSIS_CACHE_SIZE and file != kept:
+            file.unlink(missing_ok=True)
+
+
 def ffprobe_run(path: Path, *args):
     command = [
         "ffprobe",
@@ -89,8 +180,29 @@ def ffprobe_run(path: Path, *args):
         *args,
         str(path),
     ]
-    output = _run(command).stdout
-    return json.loads(output)
+    return json.loads(_run_cached(path, command).read_text("utf-8", "replace"))
+
+
+def ffprobe_sections(path: Path, *args) -> Iterator[tuple[str, dict[str, str]]]:
+    """Runs ffprobe with compact output and yields each section, like a frame or a stream, one
+    line at a time, so that long recordings are never held in memory as a whole.
+    """
+    command = [
+        "ffprobe",
+        "-output_format",
+        "compact",
+        *args,
+        str(path),
+    ]
+    with _run_cached(path, command).open(encoding="utf-8", errors="replace") as output:
+        for line in output:
+            section, *values = line.rstrip("\n").split("|")
+            yield section, dict(value.split("=", 1) for value in values)
+
+
+def ffmpeg_analyze(path: Path, *args) -> str:
+    """Runs ffmpeg on a file, unless cached, and returns what its filters logged."""
+    return _run_cached(path, FFMPEG_COMMAND + [*args], stderr=True).read_text("utf-8", "replace")
 
 
 def ffmpeg_run(*args):
@@ -465,14 +577,40 @@ def file_size(path: Path) -> int:
         return 0
 
 
-@dataclass
-class FfprobeVideoOutputFrame:
-    pts: float
-    picture_type: str
+class FrameTable:
+    """Presentation time stamps of frames in a column, using a few bytes per frame."""
 
-    def __init__(self, frame):
-        self.pts = float(frame["pts_time"])
-        self.picture_type = frame["pict_type"]
+    def __init__(self):
+        self.pts = array("d")
+
+    def __len__(self) -> int:
+        return len(self.pts)
+
+
+class VideoFrameTable(FrameTable):
+    """Presentation time stamps and picture types of video frames, one character per frame."""
+
+    def __init__(self):
+        super().__init__()
+        self.picture_types = bytearray()
+
+    def append(self, pts: float, picture_type: str):
+        self.pts.append(pts)
+        self.picture_types += picture_type[:1].encode() or b"?"
+
+
+class AudioFrameTable(FrameTable):
+    """Presentation time stamps, channels and number of samples of audio frames."""
+
+    def __init__(self):
+        super().__init__()
+        self.channels = array("H")
+        self.number_of_samples = array("I")
+
+    def append(self, pts: float, channels: int, number_of_samples: int):
+        self.pts.append(pts)
+        self.channels.append(channels)
+        self.number_of_samples.append(number_of_samples)
 
 
 @dataclass
@@ -482,19 +620,7 @@ class FfprobeVideoOutput:
     height: int
     real_base_fps: Fraction | None
     average_fps: Fraction | None
-    frames: list[FfprobeVideoOutputFrame]
-
-
-@dataclass
-class FfprobeAudioOutputFrame:
-    pts: float
-    channels: int
-    number_of_samples: int
-
-    def __init__(self, frame):
-        self.pts = float(frame["pts_time"])
-        self.channels = frame["channels"]
-        self.number_of_samples = frame["nb_samples"]
+    frames: VideoFrameTable
 
 
 @dataclass
@@ -505,7 +631,7 @@ class FfprobeAudioOutput:
     channels: int = 0
     channel_layout: str = ""
     bit_rate: int = 0
-    frames: list[FfprobeAudioOutputFrame] = field(default_factory=list)
+    frames: AudioFrameTable = field(default_factory=AudioFrameTable)
 
 
 @dataclass
@@ -521,24 +647,28 @@ class FfprobeOutput:
     format: FfprobeFormatOutput
 
 
-def ffprobe_video(path: Path):
-    output = ffprobe_run(
+def ffprobe_video(path: Path) -> FfprobeVideoOutput:
+    frames = VideoFrameTable()
+    stream: dict[str, str] | None = None
+    for section, values in ffprobe_sections(
         path,
         "-select_streams",
         "v:0",
         "-show_entries",
         "stream=codec_name,width,height,r_frame_rate,avg_frame_rate:frame=pict_type,pts_time",
-    )
-    stream = output["streams"][0]
-    real_base_fps = _get_fps(stream, "r_frame_rate")
-    average_fps = _get_fps(stream, "avg_frame_rate")
-    frames = [FfprobeVideoOutputFrame(frame) for frame in output["frames"]]
+    ):
+        if section == "frame":
+            frames.append(float(values["pts_time"]), values["pict_type"])
+        elif section == "stream":
+            stream = values
+    if stream is None:
+        raise Exception(f"No video stream in {path}.")
     return FfprobeVideoOutput(
         codec=stream["codec_name"],
-        width=stream["width"],
-        height=stream["height"],
-        real_base_fps=real_base_fps,
-        average_fps=average_fps,
+        width=int(stream["width"]),
+        height=int(stream["height"]),
+        real_base_fps=_get_fps(stream, "r_frame_rate"),
+        average_fps=_get_fps(stream, "avg_frame_rate"),
         frames=frames,
     )
 
@@ -557,23 +687,26 @@ def _get_fps(stream, name: str) -> Fraction | None:
 
 
 def ffprobe_audio(path) -> FfprobeAudioOutput:
-    output = ffprobe_run(
+    frames = AudioFrameTable()
+    stream: dict[str, str] | None = None
+    for section, values in ffprobe_sections(
         path,
         "-select_streams",
         "a:0",
         "-show_entries",
         "stream=codec_name,profile,sample_rate,channels,channel_layout,bit_rate:frame=nb_samples,pts_time,channels",
-    )
-    streams = output["streams"]
-    if len(streams) == 0:
+    ):
+        if section == "frame":
+            frames.append(float(values["pts_time"]), int(values["channels"]), int(values["nb_samples"]))
+        elif section == "stream":
+            stream = values
+    if stream is None:
         return FfprobeAudioOutput()
-    stream = streams[0]
-    frames = [FfprobeAudioOutputFrame(frame) for frame in output["frames"]]
     return FfprobeAudioOutput(
         codec=stream["codec_name"],
         profile=stream["profile"],
         sample_rate=int(stream["sample_rate"]),
-        channels=stream["channels"],
+        channels=int(stream["channels"]),
         channel_layout=stream["channel_layout"],
         bit_rate=int(stream["bit_rate"]),
         frames=frames,
@@ -611,25 +744,57 @@ class QrCode:
             self.pts = -1
 
 
-def _decode_qr_code(file: Path) -> QrCode:
-    proc = subprocess.run(["qrtool", "decode", str(file)], check=False, capture_output=True, text=True)
-    return QrCode(proc.stdout)
+def decode_qr_code(image: np.ndarray) -> QrCode:
+    """Decodes the QR code in a grayscale image, if any."""
+    barcode = zxingcpp.read_barcode(image, formats=zxingcpp.BarcodeFormats(zxingcpp.BarcodeFormat.QRCode))
+    return QrCode("" if barcode is None else barcode.text)
+
+
+def submit_qr_code(executor: Executor, pending: set[Future[QrCode]], image: np.ndarray) -> Future[QrCode]:
+    """Submits an image to decode, once fewer than the maximum number of images are pending."""
+    if len(pending) >= MAXIMUM_PENDING_QR_CODES:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        pending -= done
+    future = executor.submit(decode_qr_code, image)
+    pending.add(future)
+    return future
 
 
 def read_qr_codes(path: Path, crop: Crop) -> list[QrCode]:
-    qr_codes_dir = Path(f"{path}-qr-codes")
-    qr_codes_dir.mkdir()
-    ffmpeg_run(
+    """Decodes the QR code in the crop of every frame. ffmpeg streams the grayscale crops,
+    which are decoded as they arrive by a pool of processes.
+    """
+    command = FFMPEG_COMMAND + [
         "-i",
         str(path),
+        "-an",
         "-vf",
         f"crop=x={crop.x}:y={crop.y}:w={crop.width}:h={crop.height}",
-        f"{qr_codes_dir}/%05d.jpg",
-    )
-    with ThreadPoolExecutor(max_workers=32) as executor:
-        qr_codes = list(executor.map(_decode_qr_code, sorted(qr_codes_dir.iterdir())))
-    shutil.rmtree(qr_codes_dir)
-    return qr_codes
+        "-f",
+        "rawvideo",
+        "-pix_fmt",
+        "gray",
+        "-",
+    ]
+    frame_size = crop.width * crop.height
+    started = time.monotonic()
+    futures: list[Future[QrCode]] = []
+    pending: set[Future[QrCode]] = set()
+    cache: FrameCache[Future[QrCode]] = FrameCache()
+    with ProcessPoolExecutor() as executor, tempfile.TemporaryFile() as errors:
+        with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=errors) as process:
+            assert process.stdout is not None
+            while len(data := process.stdout.read(frame_size)) == frame_size:
+                image = np.frombuffer(data, np.uint8).reshape(crop.height, crop.width)
+                futures.append(cache.get(frame_hash(data), lambda: submit_qr_code(executor, pending, image)))
+        LOGGER.debug("Command (%.3f s): %s", time.monotonic() - started, " ".join(command))
+        LOGGER.debug("Decoded %d distinct QR code crops of %d frames.", cache.misses, len(futures))
+        if process.returncode != 0:
+            errors.seek(0)
+            raise subprocess.CalledProcessError(
+                process.returncode, command, stderr=errors.read().decode("utf-8", "replace")
+            )
+        return [future.result() for future in futures]
 
 
 def read_video_frame(path: Path, timestamp: float, crop: Crop | None = None) -> Image:
@@ -657,7 +822,10 @@ def read_video_region_colors(
     rows: int,
     start: float,
     duration: float,
-) -> list[VideoRegionColors]:
+) -> Iterator[VideoRegionColors]:
+    """The colors of a grid of regions of a crop of every frame, as ffmpeg decodes them. ffmpeg
+    is stopped if the caller stops iterating early.
+    """
     command = FFMPEG_COMMAND + [
         "-ss",
         f"{start:.3f}",
@@ -671,139 +839,79 @@ def read_video_region_colors(
         f"format=rgb24,scale={columns}:{rows}:flags=area,showinfo",
         "-fps_mode",
         "passthrough",
+        "-flush_packets",
+        "1",
         "-f",
         "rawvideo",
         "-pix_fmt",
         "rgb24",
         "-",
     ]
-    proc = _run_logged(command, False)
-    presentation_time_stamps = [
-        float(pts) for pts in RE_SHOWINFO_PTS.findall(proc.stderr.decode("utf-8", "replace"))
-    ]
     frame_size = 3 * columns * rows
-    frames = []
-    for index, pts in enumerate(presentation_time_stamps):
-        data = proc.stdout[index * frame_size : (index + 1) * frame_size]
-        if len(data) < frame_size:
-            break
-        colors = [Pixel(*data[offset : offset + 3]) for offset in range(0, frame_size, 3)]
-        frames.append(VideoRegionColors(start + pts, colors))
-    return frames
+    presentation_time_stamps: queue.Queue[float | None] = queue.Queue()
+    log: list[str] = []
+    started = time.monotonic()
+    with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as process:
+        assert process.stdout is not None and process.stderr is not None
+        reader = threading.Thread(
+            target=_read_showinfo_log,
+            args=(process.stderr, presentation_time_stamps, log),
+            daemon=True,
+        )
+        reader.start()
+        try:
+            while len(data := process.stdout.read(frame_size)) == frame_size:
+                pts = presentation_time_stamps.get()
+                if pts is None:
+                    break
+                yield VideoRegionColors(
+                    start + pts, [Pixel(*data[offset : offset + 3]) for offset in range(0, frame_size, 3)]
+                )
+        except BaseException:
+            process.kill()
+            raise
+        finally:
+            reader.join()
+            LOGGER.debug("Command (%.3f s): %s", time.monotonic() - started, " ".join(command))
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command, stderr="".join(log))
+
+
+def _read_showinfo_log(
+    stderr: IO[bytes], presentation_time_stamps: queue.Queue[float | None], log: list[str]
+):
+    for line in stderr:
+        text = line.decode("utf-8", "replace")
+        match = RE_SHOWINFO_PTS.match(text)
+        if match is None:
+            log.append(text)
+        else:
+            presentation_time_stamps.put(float(match.group(1)))
+    presentation_time_stamps.put(None)
 
 
 def measure_mean_volume(path: Path) -> float:
-    return _measure_volume(path, "mean_volume", None)
+    return _measure_volume(path, "mean_volume")
 
 
-def measure_max_volume(path: Path, audio_filters: list[str] | None = None) -> float:
-    return _measure_volume(path, "max_volume", audio_filters)
-
-
-def _measure_volume(path: Path, name: str, audio_filters: list[str] | None) -> float:
-    output = ffmpeg_run(
+def _measure_volume(path: Path, name: str) -> float:
+    output = ffmpeg_analyze(
+        path,
         "-i",
         str(path),
         "-vn",
         "-af",
-        _audio_filter_chain(audio_filters, "volumedetect"),
+        "volumedetect",
         "-f",
         "null",
         "-",
-    ).stderr
+    )
     for found_name, value in RE_VOLUME_DETECT.findall(output):
         if found_name == name:
             return float(value)
     return -math.inf
 
 
-def _audio_filter_chain(audio_filters: list[str] | None, *extra: str) -> str:
-    return ",".join([*(audio_filters or []), *extra])
-
-
-@dataclass
-class AudioBandLevel:
-    time: float
-    level: float
-
-
-def measure_audio_band_levels(
-    path: Path,
-    filters: list[str],
-    window: float,
-    copy_timestamps: bool = False,
-) -> list[AudioBandLevel]:
-    output = ffmpeg_run(
-        *(["-copyts"] if copy_timestamps else []),
-        "-i",
-        str(path),
-        "-vn",
-        "-af",
-        ",".join(
-            [
-                f"aformat=channel_layouts=mono:sample_rates={AUDIO_BAND_SAMPLE_RATE}",
-                f"asetnsamples=n={round(window * AUDIO_BAND_SAMPLE_RATE)}",
-                *filters,
-                "astats=metadata=1:reset=1:measure_perchannel=RMS_level:measure_overall=none",
-                "ametadata=print:key=lavfi.astats.1.RMS_level",
-            ]
-        ),
-        "-f",
-        "null",
-        "-",
-    ).stderr
-    levels: dict[float, float] = {}
-    window_time = 0.0
-    for line in output.splitlines():
-        match = RE_METADATA_TIME.match(line)
-        if match is not None:
-            window_time = float(match.group(1))
-            continue
-        match = RE_ASTATS_RMS_LEVEL.match(line)
-        if match is not None:
-            levels[window_time] = _parse_level(match.group(2))
-    return [AudioBandLevel(window_time, level) for window_time, level in sorted(levels.items())]
-
-
-def _parse_level(value: str) -> float:
-    return -120.0 if value.endswith("inf") else float(value)
-
-
-def detect_audio_onsets(
-    path: Path,
-    noise_db: float,
-    minimum_silence: float,
-    audio_filters: list[str] | None = None,
-    copy_timestamps: bool = False,
-    start: float | None = None,
-    duration: float | None = None,
-) -> list[float]:
-    output = ffmpeg_run(
-        *(["-copyts"] if copy_timestamps else []),
-        *([] if start is None else ["-ss", str(start)]),
-        *([] if duration is None else ["-t", str(duration)]),
-        "-i",
-        str(path),
-        "-vn",
-        "-af",
-        _audio_filter_chain(audio_filters, f"silencedetect=noise={noise_db}dB:duration={minimum_silence}"),
-        "-f",
-        "null",
-        "-",
-    ).stderr
-    return [float(value) for kind, value in RE_SILENCE_DETECT.findall(output) if kind == "end"]
-
-
-def detect_beeps(path: Path) -> list[float]:
-    audio_filters = [f"bandpass=f={BEEP_FREQUENCY}:width_type=h:w={BEEP_BANDWIDTH}"]
-    max_volume = measure_max_volume(path, audio_filters)
-    if max_volume == -math.inf:
-        return []
-    onsets = detect_audio_onsets(path, max_volume - BEEP_LEVEL_MARGIN, 2 * BEEP_DURATION, audio_filters)
-    end_of_file = ffprobe_format(path).duration - BEEP_DURATION
-    return [onset for onset in onsets if onset < end_of_file]
-
-
 @dataclass
 class Silence:
     start: float
@@ -811,7 +919,8 @@ class Silence:
 
 
 def detect_silence(path: Path, noise_db: float, minimum_duration: float) -> list[Silence]:
-    output = ffmpeg_run(
+    output = ffmpeg_analyze(
+        path,
         "-i",
         str(path),
         "-vn",
@@ -820,7 +929,7 @@ def detect_silence(path: Path, noise_db: float, minimum_duration: float) -> list
         "-f",
         "null",
         "-",
-    ).stderr
+    )
     silences = []
     start = None
     for kind, value in RE_SILENCE_DETECT.findall(output):
@@ -834,57 +943,6 @@ def detect_silence(path: Path, noise_db: float, minimum_duration: float) -> list
     return silences
 
 
-def extract_ltc_wav(path: Path, output: Path):
-    ffmpeg_run("-i", str(path), "-vn", "-map", "0:a:0", "-c:a", "pcm_s16le", str(output))
-
-
-def read_unique_frame_presentation_time_stamps(path: Path, crop: Crop | None = None) -> list[float]:
-    filters = []
-    if crop is not None:
-        filters.append(f"crop=x={crop.x}:y={crop.y}:w={crop.width}:h={crop.height}")
-    filters += ["mpdecimate", "showinfo"]
-    output = ffmpeg_run(
-        "-i",
-        str(path),
-        "-vf",
-        ", ".join(filters),
-        "-fps_mode",
-        "vfr",
-        "-an",
-        "-f",
-        "null",
-        "-",
-    ).stderr
-    return [float(pts) for pts in RE_SHOWINFO_PTS.findall(output)]
-
-
-@dataclass
-class VideoTimecode:
-    pts: float
-    hours: int
-    minutes: int
-    seconds: int
-    frame: int
-
-    def time_of_day(self, fps: int) -> float:
-        return 3600 * self.hours + 60 * self.minutes + self.seconds + self.frame / fps
-
-
-def read_video_timecodes(path: Path) -> list[VideoTimecode | None]:
-    output = ffprobe_run(path, "-select_streams", "v:0", "-show_frames")
-    return [_parse_video_timecode(frame) for frame in output["frames"]]
-
-
-def _parse_video_timecode(frame) -> VideoTimecode | None:
-    for side_data in frame.get("side_data_list", []):
-        if side_data.get("side_data_type") != "SMPTE 12-1 timecode":
-            continue
-        for timecode in side_data.get("timecodes", []):
-            hours, minutes, seconds, number = (int(part) for part in timecode["value"].split(":"))
-            return VideoTimecode(float(frame["pts_time"]), hours, minutes, seconds, number)
-    return None
-
-
 def create_qr_codes_video(output_file: Path):
     ffmpeg_run(
         "-t",
@@ -1,6 +1,7 @@
 import logging
 import time
 from collections import defaultdict
+from collections.abc import Callable
 from dataclasses import dataclass
 from dataclasses import field
 
@@ -238,6 +239,7 @@ class Monitor:
         ingests_bitrate_range: Range,
         duration: float,
         shaper: TrafficShaper | None,
+        captured_bitrates: Callable[[], dict[str, float]] | None = None,
     ):
         self._moblin = moblin
         self._stream_recorder = stream_recorder
@@ -247,6 +249,7 @@ class Monitor:
         self._duration = duration
         self._traffic_shaping = "none" if shaper is None else shaper.description()
         self._shaper_monitor = None if shaper is None else ShaperMonitor(shaper)
+        self._captured_bitrates = captured_bitrates
         self._start_time = time.monotonic()
         self._next_log_time = time.monotonic()
         self._previous_poll_time: float | None = None
@@ -391,6 +394,18 @@ class Monitor:
         )
         if self._shaper_monitor is not None:
             self._shaper_monitor.log_status()
+        self._log_captured_bitrates()
+
+    def _log_captured_bitrates(self):
+        if self._captured_bitrates is None:
+            return
+        bitrates = self._captured_bitrates()
+        if len(bitrates) == 0:
+            return
+        LOGGER.info(
+            "  Captured streams in Mbps: %s.",
+            ", ".join(f"{name}: {format_mbps(bitrate)}" for name, bitrate in bitrates.items()),
+        )
 
     def report(self):
         now = time.monotonic()
@@ -1,40 +1,60 @@
+import hashlib
 import json
 import logging
 import re
-import struct
 import subprocess
+import sys
+import threading
 import time
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
-from datetime import datetime
+from enum import StrEnum
 from pathlib import Path
+from typing import Any
 
+import numpy as np
 from humanfriendly import format_size
 from humanfriendly import format_timespan
 
+from .capture_report import CaptureReport
+from .capture_report import Series
 from .ffmpeg import file_size
-from .monitor import log_table
+from .pacing import GAP_BIN_EDGES
+from .pacing import PACING_WINDOWS_MS
+from .pacing import Pacing
+from .pacing import PacingSeries
+from .pcap import MINIMUM_RANGE_SIZE
+from .pcap import SNAPSHOT_LENGTH
+from .pcap import PacketTable
+from .pcap import scan_packet_tables
+from .pcap import split_capture
 from .process import ManagedProcess
+from .ring_capture import RingCapture
+from .srt_analysis import SRT_COUNTERS
+from .srt_analysis import SrtSeries
+from .srt_analysis import count_srt
+from .tcp_flow import TCP_COUNTERS
+from .tcp_flow import TCP_FLAG_ACK
+from .tcp_flow import TcpFlow
+from .tcp_flow import TcpSeries
 from .traffic_shaper import PROTOCOL_NUMBERS
 from .traffic_shaper import Protocol
 from .utils import wait_until
 
 LOGGER = logging.getLogger(__name__)
 
-SNAPSHOT_LENGTH = 128
-READ_SIZE = 4 * 1024 * 1024
+CURRENT_BITRATE_WINDOW = 10
+CACHE_VERSION = 2
+# How many bytes from the start and before the analyzed end of a pcap file are hashed to tell
+# whether the file has only grown since. Enough to include several record headers.
+CACHE_SAMPLE_SIZE = 4096
 OTHER_NAME = "Other"
-TEMPLATE_FILE = Path(__file__).parent / "network_capture.html"
-PROTOCOLS = {number: protocol for protocol, number in PROTOCOL_NUMBERS.items()}
-PCAP_MAGIC_MICROSECONDS = 0xA1B2C3D4
-PCAP_MAGIC_NANOSECONDS = 0xA1B23C4D
-LINK_TYPE_NULL = 0
-LINK_TYPE_ETHERNET = 1
-ETHERNET_TYPE_IPV4 = 0x0800
-ETHERNET_TYPE_IPV6 = 0x86DD
-ETHERNET_TYPE_VLAN = 0x8100
-NULL_FAMILY_IPV4 = 2
-NULL_FAMILY_IPV6 = 30
+
+
+class CaptureBackend(StrEnum):
+    TCPDUMP = "tcpdump"
+    RING = "ring"
 
 
 @dataclass
@@ -42,65 +62,8 @@ class CaptureStream:
     name: str
     protocol: Protocol
     port: int
-
-
-@dataclass
-class Series:
-    name: str
-    slot: int
-    total_bytes: int
-    bitrates: list[float]
-
-    def maximum_mbps(self) -> float:
-        return max(self.bitrates, default=0)
-
-    def average_mbps(self, duration: float) -> float:
-        return 8 * self.total_bytes / duration / 1e6
-
-
-@dataclass
-class CaptureReport:
-    start_time: float
-    duration: float
-    files: list[Path]
-    series: list[Series]
-    total_slot: int
-    settings: dict[str, str]
-
-    def log(self):
-        log_table(
-            "Captured bitrates",
-            ["Average Mbps", "Maximum Mbps", "Total"],
-            [
-                [
-                    series.name,
-                    f"{series.average_mbps(self.duration):.1f}",
-                    f"{series.maximum_mbps():.1f}",
-                    format_size(series.total_bytes),
-                ]
-                for series in self.series
-            ],
-        )
-
-    def write_html(self, output: Path):
-        data = {
-            "startTime": datetime.fromtimestamp(self.start_time).strftime("%Y-%m-%d %H:%M:%S"),
-            "duration": format_timespan(round(self.duration)),
-            "files": ", ".join(file.name for file in self.files),
-            "totalSlot": self.total_slot,
-            "settings": [{"name": name, "value": value} for name, value in self.settings.items()],
-            "series": [
-                {
-                    "name": series.name,
-                    "slot": series.slot,
-                    "totalBytes": series.total_bytes,
-                    "bitrates": series.bitrates,
-                }
-                for series in self.series
-            ],
-        }
-        template = TEMPLATE_FILE.read_text()
-        output.write_text(template.replace('"__CAPTURE_DATA__"', json.dumps(data)))
+    srt: bool = False
+    rtmp: bool = False
 
 
 class Bitrates:
@@ -108,20 +71,271 @@ class Bitrates:
         self._names = list(dict.fromkeys([stream.name for stream in streams] + [OTHER_NAME]))
         self._ports = {(stream.protocol, stream.port): stream.name for stream in streams}
         self._buckets: dict[str, dict[int, int]] = {name: defaultdict(int) for name in self._names}
+        self._srt_names = list(dict.fromkeys([stream.name for stream in streams if stream.srt]))
+        self._rtmp_names = list(dict.fromkeys([stream.name for stream in streams if stream.rtmp]))
+        self._counters = self._empty_counters()
+        self._flows: dict[tuple[int, int, int, int], TcpFlow] = {}
+        self._pacings = {name: Pacing() for name in self._names if name != OTHER_NAME}
+        self._streams = streams
         self._settings = settings
         self._files: list[Path] = []
+        self._last_second: int | None = None
+        # What was counted in each file, to cache next to it, and the analysis of the files
+        # that are read in order.
+        self._file_bitrates: dict[Path, Bitrates] = {}
+        self._scanners: dict[Path, Bitrates] = {}
+        self._cache_offsets: dict[Path, int] = {}
+
+    def add_file(self, file: Path, start: int = 24) -> int:
+        self._add_file_name(file)
+        offset = start = self._read_cache(file, start)
+        scanner = self._scanners.setdefault(file, Bitrates(self._streams, {}))
+        for table, offset in scan_packet_tables(file, start, tcp=bool(self._rtmp_names)):
+            scanner.add_packets(table)
+        if offset > start:
+            self._merge_file(file, *scanner.take())
+        return offset
+
+    def add_files(self, files: list[Path], starts: dict[Path, int] | None = None) -> dict[Path, int]:
+        starts = dict(starts or {})
+        if self._rtmp_names:
+            # TCP flows are followed from the first packet on, so the files are read in order,
+            # continuing the flows of polling.
+            for file in files:
+                starts[file] = self.add_file(file, starts.get(file, 24))
+        else:
+            self._count_ranges(files, starts)
+        # The caches are only written here, as the files grow all the time while polled.
+        for file in files:
+            if file in self._file_bitrates and starts[file] != self._cache_offsets.get(file):
+                write_cache(file, self._streams, self._file_bitrates[file], starts[file])
+                self._cache_offsets[file] = starts[file]
+        return starts
+
+    def _count_ranges(self, files: list[Path], starts: dict[Path, int]):
+        ranges = []
+        for file in files:
+            self._add_file_name(file)
+            starts[file] = self._read_cache(file, starts.get(file, 24))
+            ranges += [(file, start, end) for start, end in split_capture(file, starts[file])]
+        if sum(end - start for _, start, end in ranges) <= MINIMUM_RANGE_SIZE:
+            results = [count_bytes(*capture_range, self._streams) for capture_range in ranges]
+        else:
+            with ProcessPoolExecutor() as executor:
+                futures = [
+                    executor.submit(count_bytes, *capture_range, self._streams) for capture_range in ranges
+                ]
+                results = [future.result() for future in futures]
+        for (file, _, _), (buckets, counters, pacings, offset) in zip(ranges, results):
+            self._merge_file(file, buckets, counters, pacings)
+            starts[file] = offset
+
+    def _read_cache(self, file: Path, start: int) -> int:
+        """Counts what is cached for a file not read before, and returns where to continue."""
+        if start != 24 or file in self._file_bitrates:
+            return start
+        cached = read_cache(file, self._streams)
+        if cached is None:
+            return start
+        buckets, counters, pacings, offset = cached
+        self._merge_file(file, buckets, counters, pacings)
+        self._cache_offsets[file] = offset
+        LOGGER.debug("Read the analysis of %s up to %s from its cache.", file, format_size(offset))
+        return offset
+
+    def _merge_file(
+        self,
+        file: Path,
+        buckets: dict[str, dict[int, int]],
+        counters: dict[str, dict[str, dict[int, int]]],
+        pacings: dict[str, Pacing],
+    ):
+        self.merge(buckets, counters, pacings)
+        self._file_bitrates.setdefault(file, Bitrates(self._streams, {})).merge(buckets, counters, pacings)
+
+    def merge(
+        self,
+        buckets: dict[str, dict[int, int]],
+        counters: dict[str, dict[str, dict[int, int]]] | None = None,
+        pacings: dict[str, Pacing] | None = None,
+    ):
+        for name, counts in buckets.items():
+            for second, count in counts.items():
+                self._buckets[name][second] += count
+            self._update_last_second(max(counts))
+        for name, stream_counters in (counters or {}).items():
+            for counter, counts in stream_counters.items():
+                for second, count in counts.items():
+                    self._counters[name][counter][second] += count
+        for name, pacing in (pacings or {}).items():
+            self._pacings[name].merge(pacing)
+
+    def buckets(self) -> dict[str, dict[int, int]]:
+        return {name: dict(buckets) for name, buckets in self._buckets.items() if buckets}
+
+    def counters(self) -> dict[str, dict[str, dict[int, int]]]:
+        return {
+            name: {counter: dict(counts) for counter, counts in counters.items()}
+            for name, counters in self._counters.items()
+        }
+
+    def pacings(self) -> dict[str, Pacing]:
+        return {name: pacing for name, pacing in self._pacings.items() if pacing.packets}
+
+    def take(
+        self,
+    ) -> tuple[dict[str, dict[int, int]], dict[str, dict[str, dict[int, int]]], dict[str, Pacing]]:
+        """Returns what was counted since the last call and counts anew, keeping the state of
+        TCP flows and pacing windows.
+        """
+        taken = (
+            self.buckets(),
+            self.counters(),
+            {name: pacing.take() for name, pacing in self._pacings.items() if pacing.packets},
+        )
+        self._buckets = {name: defaultdict(int) for name in self._names}
+        self._counters = self._empty_counters()
+        return taken
+
+    def _empty_counters(self) -> dict[str, dict[str, dict[int, int]]]:
+        counters: dict[str, dict[str, dict[int, int]]] = {
+            name: {counter: defaultdict(int) for counter in SRT_COUNTERS} for name in self._srt_names
+        }
+        return counters | {
+            name: {counter: defaultdict(int) for counter in TCP_COUNTERS} for name in self._rtmp_names
+        }
+
+    def add_packets(self, table: PacketTable):
+        if len(table) == 0:
+            return
+        slots = self._slots(table)
+        seconds = np.floor(table.timestamps).astype(np.int64)
+        # Only the seconds with packets are counted, as timestamps may jump far.
+        unique_seconds, indexes = np.unique(seconds, return_inverse=True)
+        keys = slots * len(unique_seconds) + indexes.reshape(-1)
+        size = len(self._names) * len(unique_seconds)
+        counts = np.bincount(keys, minlength=size).reshape(len(self._names), -1)
+        sums = np.bincount(keys, weights=table.lengths, minlength=size).reshape(len(self._names), -1)
+        for slot, name in enumerate(self._names):
+            buckets = self._buckets[name]
+            for index in np.flatnonzero(counts[slot]).tolist():
+                buckets[int(unique_seconds[index])] += int(sums[slot, index])
+        self._update_last_second(int(unique_seconds[-1]))
+        self._add_srt_packets(table, slots, seconds)
+        self._add_tcp_packets(table, slots, seconds)
+        self._add_pacing(table, slots)
+
+    def _add_srt_packets(self, table: PacketTable, slots: np.ndarray, seconds: np.ndarray):
+        for name in self._srt_names:
+            rows = (slots == self._names.index(name)) & (table.protocols == PROTOCOL_NUMBERS[Protocol.UDP])
+            if not rows.any():
+                continue
+            for counter, values in count_srt(table.datagrams[rows], table.datagram_lengths[rows]).items():
+                self._add_counts(name, counter, seconds[rows], values)
+
+    def _add_tcp_packets(self, table: PacketTable, slots: np.ndarray, seconds: np.ndarray):
+        for name in self._rtmp_names:
+            rows = np.flatnonzero(
+                (slots == self._names.index(name)) & (table.protocols == PROTOCOL_NUMBERS[Protocol.TCP])
+            )
+            if len(rows) == 0:
+                continue
+            keys, directions = np.unique(
+                np.stack(
+                    [
+                        table.source_addresses[rows],
+                        table.destination_addresses[rows],
+                        table.source_ports[rows],
+                        table.destination_ports[rows],
+                    ],
+                    axis=1,
+                ).astype(np.int64),
+                axis=0,
+                return_inverse=True,
+            )
+            directions = directions.reshape(-1)
+            # All segments are added before the acknowledgements, which may be for segments
+            # in this table.
+            for direction, key in enumerate(keys.tolist()):
+                segments = rows[directions == direction]
+                segments = segments[table.payload_lengths[segments] > 0]
+                if len(segments) == 0:
+                    continue
+                flow = self._flows.setdefault(tuple(key), TcpFlow())
+                retransmitted, out_of_order = flow.add_segments(
+                    table.timestamps[segments],
+                    table.sequence_numbers[segments],
+                    table.payload_lengths[segments],
+                )
+                self._add_counts(name, "segments", seconds[segments], np.ones(len(segments)))
+                self._add_counts(name, "retransmitted", seconds[segments], retransmitted)
+                self._add_counts(name, "out_of_order", seconds[segments], out_of_order)
+            for direction, (source, destination, source_port, destination_port) in enumerate(keys.tolist()):
+                acknowledged_flow = self._flows.get((destination, source, destination_port, source_port))
+                if acknowledged_flow is None:
+                    continue
+                acknowledgements = rows[directions == direction]
+                acknowledgements = acknowledgements[table.tcp_flags[acknowledgements] & TCP_FLAG_ACK != 0]
+                times, rtts = acknowledged_flow.add_acknowledgements(
+                    table.timestamps[acknowledgements], table.acknowledgement_numbers[acknowledgements]
+                )
+                samples = np.floor(times).astype(np.int64)
+                self._add_counts(name, "rtt_samples", samples, np.ones(len(samples)))
+                self._add_counts(name, "rtt", samples, np.round(1e6 * rtts))
+
+    def _add_pacing(self, table: PacketTable, slots: np.ndarray):
+        sent = np.zeros(len(table), dtype=bool)
+        for (protocol, port), name in self._ports.items():
+            sent |= (
+                (slots == self._names.index(name))
+                & (table.protocols == PROTOCOL_NUMBERS[protocol])
+                & (table.destination_ports == port)
+            )
+        rows = np.flatnonzero(sent)
+        order = rows[np.argsort(slots[rows], kind="stable")]
+        bounds = np.searchsorted(slots[order], np.arange(len(self._names) + 1))
+        for slot, name in enumerate(self._names):
+            if name in self._pacings and bounds[slot] < bounds[slot + 1]:
+                rows = order[bounds[slot] : bounds[slot + 1]]
+                self._pacings[name].add(table.timestamps[rows], table.lengths[rows])
+
+    def _add_counts(self, name: str, counter: str, seconds: np.ndarray, values: np.ndarray):
+        unique_seconds, indexes = np.unique(seconds, return_inverse=True)
+        sums = np.bincount(indexes.reshape(-1), weights=values, minlength=len(unique_seconds))
+        counts = self._counters[name][counter]
+        for index in np.flatnonzero(sums).tolist():
+            counts[int(unique_seconds[index])] += int(sums[index])
+
+    def current_bitrates(self) -> dict[str, float]:
+        if self._last_second is None:
+            return {}
+        seconds = range(self._last_second - CURRENT_BITRATE_WINDOW, self._last_second)
+        return {
+            name: 8 * sum(buckets.get(second, 0) for second in seconds) / CURRENT_BITRATE_WINDOW
+            for name, buckets in self._buckets.items()
+            if buckets
+        }
 
-    def add_file(self, file: Path):
-        self._files.append(file)
-        ports = self._ports
-        buckets = self._buckets
-        other = buckets[OTHER_NAME]
-        for timestamp, protocol, source_port, destination_port, length in read_packets(file):
-            name = ports.get((protocol, destination_port), ports.get((protocol, source_port)))
-            if name is None:
-                other[int(timestamp)] += length
-            else:
-                buckets[name][int(timestamp)] += length
+    def _update_last_second(self, second: int):
+        if self._last_second is None or second > self._last_second:
+            self._last_second = second
+
+    def _add_file_name(self, file: Path):
+        if file not in self._files:
+            self._files.append(file)
+
+    def _slots(self, table: PacketTable) -> np.ndarray:
+        slots = np.full(len(table), self._names.index(OTHER_NAME), dtype=np.int64)
+        for protocol in {protocol for protocol, _ in self._ports}:
+            lookup = np.full(65536, -1, dtype=np.int64)
+            for (stream_protocol, port), name in self._ports.items():
+                if stream_protocol == protocol:
+                    lookup[port] = self._names.index(name)
+            matching = table.protocols == PROTOCOL_NUMBERS[protocol]
+            for ports in [table.source_ports, table.destination_ports]:
+                found = matching & (lookup[ports] >= 0)
+                slots[found] = lookup[ports[found]]
+        return slots
 
     def report(self) -> CaptureReport:
         used = [buckets for buckets in self._buckets.values() if buckets]
@@ -148,6 +362,74 @@ class Bitrates:
                 for slot, name in enumerate(self._names)
                 if self._buckets[name]
             ],
+            srt_series=[
+                self._srt_series(name, first, last)
+                for name in self._srt_names
+                if self._counters[name]["packets"]
+            ],
+            tcp_series=[
+                self._tcp_series(name, first, last)
+                for name in self._rtmp_names
+                if self._counters[name]["segments"]
+            ],
+            pacing_series=[
+                self._pacing_series(name, first, last)
+                for name, pacing in self._pacings.items()
+                if pacing.packets
+            ],
+        )
+
+    def _pacing_series(self, name: str, first: int, last: int) -> PacingSeries:
+        pacing = self._pacings[name]
+        seconds = range(first, last + 1)
+        bytes_per_second = np.array([self._buckets[name].get(second, 0) for second in seconds])
+        peak_bytes = {
+            window: pacing.peaks[index].values(seconds) for index, window in enumerate(PACING_WINDOWS_MS)
+        }
+        return PacingSeries(
+            name=name,
+            slot=self._names.index(name),
+            packets=pacing.packets,
+            gap_counts=pacing.gaps.tolist(),
+            peak_bytes={window: peaks.tolist() for window, peaks in peak_bytes.items()},
+            peak_to_mean_ratios={
+                window: np.round(
+                    np.divide(
+                        peaks * (1000 / window),
+                        bytes_per_second,
+                        out=np.zeros(len(peaks)),
+                        where=bytes_per_second > 0,
+                    ),
+                    2,
+                ).tolist()
+                for window, peaks in peak_bytes.items()
+            },
+        )
+
+    def _tcp_series(self, name: str, first: int, last: int) -> TcpSeries:
+        counters = self._counters[name]
+        seconds = range(first, last + 1)
+        return TcpSeries(
+            name=name,
+            slot=self._names.index(name),
+            segments=[counters["segments"].get(second, 0) for second in seconds],
+            retransmitted_segments=[counters["retransmitted"].get(second, 0) for second in seconds],
+            out_of_order_segments=[counters["out_of_order"].get(second, 0) for second in seconds],
+            rtts=average_counts(counters["rtt"], counters["rtt_samples"], 1000, seconds),
+        )
+
+    def _srt_series(self, name: str, first: int, last: int) -> SrtSeries:
+        counters = self._counters[name]
+        seconds = range(first, last + 1)
+
+        return SrtSeries(
+            name=name,
+            slot=self._names.index(name),
+            packets=[counters["packets"].get(second, 0) for second in seconds],
+            retransmitted_packets=[counters["retransmitted"].get(second, 0) for second in seconds],
+            nak_ranges=[counters["nak_ranges"].get(second, 0) for second in seconds],
+            rtts=average_counts(counters["rtt"], counters["acks"], 1000, seconds),
+            link_capacities=average_counts(counters["capacity"], counters["capacities"], 1, seconds),
         )
 
 
@@ -159,13 +441,19 @@ class NetworkCapture:
         name: str,
         streams: list[CaptureStream],
         settings: dict[str, str],
+        backend: CaptureBackend = CaptureBackend.TCPDUMP,
     ):
         self._hosts = hosts
         self._directory = directory
         self._name = name
         self._streams = streams
         self._settings = settings
+        self._backend = backend
         self._processes: list[ManagedProcess] = []
+        self._rings: list[RingCapture] = []
+        self._lock = threading.Lock()
+        self._bitrates = Bitrates(streams, settings)
+        self._offsets: dict[Path, int] = {}
         self.files: list[Path] = []
 
     def __enter__(self):
@@ -184,21 +472,36 @@ class NetworkCapture:
         for process in [process for process in self._processes if not process.is_running()]:
             LOGGER.warning("A network capture exited. No longer capturing all packets.")
             self._processes.remove(process)
+        for ring in [ring for ring in self._rings if not ring.is_running()]:
+            LOGGER.warning("A network capture exited. No longer capturing all packets.")
+            self._rings.remove(ring)
+        with self._lock:
+            for file in self.files:
+                self._offsets[file] = self._bitrates.add_file(file, self._offsets.get(file, 24))
+
+    def current_bitrates(self) -> dict[str, float]:
+        with self._lock:
+            return self._bitrates.current_bitrates()
 
     def stop(self):
         for process in self._processes:
             process.stop()
         self._processes = []
+        for ring in self._rings:
+            ring.stop()
+            LOGGER.info("Captured %s of packets on %s.", format_size(ring.total_bytes), ring.interface)
+        self._rings = []
         for file in self.files:
             LOGGER.info("Captured %s of packets to %s.", format_size(file_size(file)), file)
 
     def report(self):
         LOGGER.debug("Analyzing the network capture...")
         started = time.monotonic()
-        bitrates = Bitrates(self._streams, self._settings)
-        for file in self.files:
-            bitrates.add_file(file)
-        report = bitrates.report()
+        with self._lock:
+            self._offsets = self._bitrates.add_files(self.files, self._offsets)
+            report = self._bitrates.report()
+            if self._backend == CaptureBackend.RING:
+                report.files = [self._write_summary()]
         report.log()
         file = self._directory / f"{self._name}-bitrates.html"
         report.write_html(file)
@@ -208,7 +511,55 @@ class NetworkCapture:
         )
         LOGGER.info("Open the bitrate graphs with 'open %s'.", file)
 
+    def _write_summary(self) -> Path:
+        file = self._directory / f"{self._name}-bitrates.json"
+        summary = {
+            "settings": self._settings,
+            "bytesPerSecond": {
+                name: {str(second): count for second, count in sorted(buckets.items())}
+                for name, buckets in self._bitrates.buckets().items()
+            },
+            "countersPerSecond": {
+                name: {
+                    counter: {str(second): count for second, count in sorted(counts.items())}
+                    for counter, counts in counters.items()
+                }
+                for name, counters in self._bitrates.counters().items()
+            },
+            "pacing": {
+                name: {
+                    "gapBinEdges": GAP_BIN_EDGES.tolist(),
+                    "gapCounts": pacing.gaps.tolist(),
+                    "peakBytesPerSecond": {
+                        f"{window}ms": {
+                            str(second): int(count)
+                            for second, count in zip(
+                                peaks.seconds().tolist(), peaks.values(peaks.seconds()).tolist()
+                            )
+                        }
+                        for window, peaks in zip(PACING_WINDOWS_MS, pacing.peaks)
+                    },
+                }
+                for name, pacing in self._bitrates.pacings().items()
+            },
+        }
+        file.write_text(json.dumps(summary))
+        LOGGER.info("Wrote the network capture summary to %s.", file)
+        return file
+
     def _start(self, interface: str):
+        if self._backend == CaptureBackend.RING:
+            self._start_ring(interface)
+        else:
+            self._start_tcpdump(interface)
+
+    def _start_ring(self, interface: str):
+        ring = RingCapture(interface, self._hosts, self._bitrates.add_packets, self._lock)
+        ring.start()
+        self._rings.append(ring)
+        LOGGER.info("Capturing packets on %s to memory.", interface)
+
+    def _start_tcpdump(self, interface: str):
         file = self._directory / f"{self._name}-{interface}.pcap"
         command = [
             "tcpdump",
@@ -222,6 +573,7 @@ class NetworkCapture:
             str(file),
             " or ".join(f"host {host}" for host in self._hosts),
         ]
+        cache_file(file).unlink(missing_ok=True)
         process = ManagedProcess(command, LOGGER)
         process.start()
         self._processes.append(process)
@@ -240,6 +592,8 @@ def capture_is_started(process: ManagedProcess, file: Path) -> bool:
 
 
 def find_interface(host: str) -> str:
+    if sys.platform == "linux":
+        return find_linux_interface(host)
     output = subprocess.run(
         ["route", "-n", "get", host],
         check=True,
@@ -252,102 +606,136 @@ def find_interface(host: str) -> str:
     return match.group(1)
 
 
-def read_packets(file: Path):
-    with file.open("rb") as fin:
-        header = fin.read(24)
-        if len(header) < 24:
-            return
-        endian, resolution = pcap_format(header)
-        link_type = struct.unpack_from(f"{endian}I", header, 20)[0]
-        record_header = struct.Struct(f"{endian}IIII")
-        buffer = b""
-        while True:
-            chunk = fin.read(READ_SIZE)
-            if not chunk:
-                return
-            buffer += chunk
-            offset = 0
-            length = len(buffer)
-            view = memoryview(buffer)
-            while offset + 16 <= length:
-                seconds, fraction, captured_length, original_length = record_header.unpack_from(
-                    buffer, offset
-                )
-                end = offset + 16 + captured_length
-                if end > length:
-                    break
-                packet = parse_packet(link_type, view[offset + 16 : end])
-                if packet is not None:
-                    yield (seconds + fraction / resolution, *packet, original_length)
-                offset = end
-            buffer = buffer[offset:]
-
-
-def pcap_format(header: bytes) -> tuple[str, float]:
-    for endian in ["<", ">"]:
-        magic = struct.unpack_from(f"{endian}I", header, 0)[0]
-        if magic == PCAP_MAGIC_MICROSECONDS:
-            return endian, 1e6
-        if magic == PCAP_MAGIC_NANOSECONDS:
-            return endian, 1e9
-    raise Exception("Not a pcap file.")
-
-
-def parse_packet(link_type: int, data: memoryview) -> tuple[Protocol, int, int] | None:
-    if link_type == LINK_TYPE_ETHERNET:
-        return parse_ethernet(data)
-    if link_type == LINK_TYPE_NULL:
-        return parse_loopback(data)
-    raise Exception(f"Unsupported network capture link type {link_type}.")
-
-
-def parse_ethernet(data: memoryview) -> tuple[Protocol, int, int] | None:
-    if len(data) < 14:
-        return None
-    ethernet_type = struct.unpack_from(">H", data, 12)[0]
-    offset = 14
-    if ethernet_type == ETHERNET_TYPE_VLAN:
-        ethernet_type, offset = struct.unpack_from(">H", data, 16)[0], 18
-    if ethernet_type == ETHERNET_TYPE_IPV4:
-        return parse_ip_v4(data, offset)
-    if ethernet_type == ETHERNET_TYPE_IPV6:
-        return parse_ip_v6(data, offset)
-    return None
-
-
-def parse_loopback(data: memoryview) -> tuple[Protocol, int, int] | None:
-    if len(data) < 4:
-        return None
-    family = struct.unpack_from("=I", data, 0)[0]
-    if family == NULL_FAMILY_IPV4:
-        return parse_ip_v4(data, 4)
-    if family == NULL_FAMILY_IPV6:
-        return parse_ip_v6(data, 4)
-    return None
+def find_linux_interface(host: str) -> str:
+    output = subprocess.run(
+        ["ip", "route", "get", host],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    match = re.search(r"\bdev\s+(\S+)", output)
+    if match is None:
+        raise Exception(f"No network interface found for '{host}'.")
+    return match.group(1)
 
 
-def parse_ip_v4(data: memoryview, offset: int) -> tuple[Protocol, int, int] | None:
-    if len(data) < offset + 20:
+def average_counts(sums: dict[int, int], counts: dict[int, int], scale: float, seconds: range) -> list[float]:
+    return [
+        round(sums.get(second, 0) / counts[second] / scale, 3) if counts.get(second) else 0
+        for second in seconds
+    ]
+
+
+def cache_file(file: Path) -> Path:
+    return file.with_name(f"{file.name}.npz")
+
+
+def write_cache(file: Path, streams: list[CaptureStream], bitrates: Bitrates, offset: int):
+    """Writes what was counted in a pcap file up to the offset next to it, with what is needed
+    to tell whether it still applies.
+    """
+    stat = file.stat()
+    names = list(dict.fromkeys([stream.name for stream in streams] + [OTHER_NAME]))
+    header = {
+        "version": CACHE_VERSION,
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns,
+        "offset": offset,
+        "digest": sample_digest(file, offset),
+        "streams": cache_streams(streams),
+        "names": names,
+    }
+    arrays: dict[str, Any] = {"header": np.array(json.dumps(header))}
+    for name, buckets in bitrates.buckets().items():
+        arrays[f"bytes_{names.index(name)}"] = second_counts(buckets)
+    for name, counters in bitrates.counters().items():
+        for counter, counts in counters.items():
+            arrays[f"{counter}_{names.index(name)}"] = second_counts(counts)
+    for name, pacing in bitrates.pacings().items():
+        index = names.index(name)
+        arrays[f"gaps_{index}"] = np.concatenate([[pacing.packets], pacing.gaps])
+        arrays[f"head_{index}"] = pacing.head
+        arrays[f"tail_{index}"] = pacing.tail
+        for window, peaks in zip(PACING_WINDOWS_MS, pacing.peaks):
+            seconds = peaks.seconds()
+            arrays[f"peaks_{window}_{index}"] = np.stack([seconds, peaks.values(seconds)])
+    temporary = cache_file(file).with_suffix(".tmp")
+    with temporary.open("wb") as output:
+        np.savez(output, **arrays)
+    temporary.replace(cache_file(file))
+
+
+def read_cache(
+    file: Path, streams: list[CaptureStream]
+) -> tuple[dict[str, dict[int, int]], dict[str, dict[str, dict[int, int]]], dict[str, Pacing], int] | None:
+    """Reads what was counted in a pcap file from its cache, if the file has not changed other
+    than growing since, and the streams are the same.
+    """
+    path = cache_file(file)
+    if not path.exists():
         return None
-    protocol = PROTOCOLS.get(data[offset + 9])
-    if protocol is None:
+    try:
+        with np.load(path) as cache:
+            arrays = {key: cache[key] for key in cache.files}
+        header = json.loads(str(arrays.pop("header")))
+    except (OSError, ValueError, KeyError) as error:
+        LOGGER.debug("Ignoring the unreadable analysis cache %s. %s", path, error)
         return None
-    if struct.unpack_from(">H", data, offset + 6)[0] & 0x1FFF:
+    if header["version"] != CACHE_VERSION or header["streams"] != cache_streams(streams):
         return None
-    return parse_ports(protocol, data, offset + 4 * (data[offset] & 0x0F))
-
-
-def parse_ip_v6(data: memoryview, offset: int) -> tuple[Protocol, int, int] | None:
-    if len(data) < offset + 40:
-        return None
-    protocol = PROTOCOLS.get(data[offset + 6])
-    if protocol is None:
-        return None
-    return parse_ports(protocol, data, offset + 40)
-
-
-def parse_ports(protocol: Protocol, data: memoryview, offset: int) -> tuple[Protocol, int, int] | None:
-    if len(data) < offset + 4:
+    stat = file.stat()
+    if stat.st_size < header["size"]:
         return None
-    source_port, destination_port = struct.unpack_from(">HH", data, offset)
-    return protocol, source_port, destination_port
+    if stat.st_size != header["size"] or stat.st_mtime_ns != header["mtime"]:
+        if sample_digest(file, header["offset"]) != header["digest"]:
+            return None
+    names = header["names"]
+    buckets: dict[str, dict[int, int]] = {}
+    counters: dict[str, dict[str, dict[int, int]]] = defaultdict(dict)
+    pacings: dict[str, Pacing] = {}
+    for key, values in arrays.items():
+        kind, _, index = key.rpartition("_")
+        name = names[int(index)]
+        if kind == "bytes":
+            buckets[name] = dict(zip(values[0].tolist(), values[1].tolist()))
+        elif kind in ("gaps", "head", "tail") or kind.startswith("peaks_"):
+            _read_pacing(pacings.setdefault(name, Pacing()), kind, values)
+        else:
+            counters[name][kind] = dict(zip(values[0].tolist(), values[1].tolist()))
+    return buckets, dict(counters), pacings, header["offset"]
+
+
+def _read_pacing(pacing: Pacing, kind: str, values: np.ndarray):
+    if kind == "gaps":
+        pacing.packets = int(values[0])
+        pacing.gaps = values[1:]
+    elif kind in ("head", "tail"):
+        setattr(pacing, kind, values)
+    elif values.shape[1] > 0:
+        pacing.peaks[PACING_WINDOWS_MS.index(int(kind[len("peaks_") :]))].maximum(values[0], values[1])
+
+
+def sample_digest(file: Path, offset: int) -> str:
+    with file.open("rb") as capture:
+        head = capture.read(min(offset, CACHE_SAMPLE_SIZE))
+        capture.seek(max(offset - CACHE_SAMPLE_SIZE, 0))
+        tail = capture.read(min(offset, CACHE_SAMPLE_SIZE))
+    return hashlib.blake2b(head + tail, digest_size=16).hexdigest()
+
+
+def cache_streams(streams: list[CaptureStream]) -> list[list]:
+    return [[stream.name, stream.protocol, stream.port, stream.srt, stream.rtmp] for stream in streams]
+
+
+def second_counts(counts: dict[int, int]) -> np.ndarray:
+    return np.array([list(counts), list(counts.values())], dtype=np.int64).reshape(2, -1)
+
+
+def count_bytes(
+    file: Path, start: int, end: int, streams: list[CaptureStream]
+) -> tuple[dict[str, dict[int, int]], dict[str, dict[str, dict[int, int]]], dict[str, Pacing], int]:
+    bitrates = Bitrates(streams, {})
+    offset = start
+    for table, offset in scan_packet_tables(file, start, end):
+        bitrates.add_packets(table)
+    return bitrates.buckets(), bitrates.counters(), bitrates.pacings(), offset
@@ -0,0 +1,136 @@
+import math
+from dataclasses import dataclass
+
+import numpy as np
+
+PACING_WINDOWS_MS = [1, 10, 100]
+# Inter-packet gaps are counted in five bins per decade from 1 µs to 10 s, and one bin below
+# and one above.
+GAP_BIN_EDGES = np.logspace(-6, 1, 7 * 5 + 1)
+
+
+@dataclass
+class PacingSeries:
+    name: str
+    slot: int
+    packets: int
+    gap_counts: list[int]
+    # The most bytes sent to the port within any window of each length in PACING_WINDOWS_MS, by
+    # the second the window starts in, and how much higher that rate is than the average rate of
+    # that second.
+    peak_bytes: dict[int, list[int]]
+    peak_to_mean_ratios: dict[int, list[float]]
+
+    def gap_percentile(self, fraction: float) -> float:
+        """The upper edge in seconds of the gap bin the fraction of gaps falls in."""
+        index = int(np.searchsorted(np.cumsum(self.gap_counts), fraction * sum(self.gap_counts)))
+        return float(GAP_BIN_EDGES[index]) if index < len(GAP_BIN_EDGES) else math.inf
+
+    def metrics(self) -> dict[str, list]:
+        return {
+            f"Pacing peak to mean rate in {window} ms windows": ratios
+            for window, ratios in self.peak_to_mean_ratios.items()
+        }
+
+
+class Pacing:
+    """How evenly the packets of one stream are sent to its port: a histogram of the gaps between
+    them, and the most bytes sent within any window of each length, by the second the window
+    starts in. Replies, like acknowledgements, would hide the pacing of the sender.
+
+    The packets within the longest window of the start and the end are kept, as head and tail
+    rows of times and lengths, so that consecutive parts of a capture analyzed on their own are
+    merged as if analyzed together.
+    """
+
+    def __init__(self):
+        self.packets = 0
+        self.gaps = np.zeros(len(GAP_BIN_EDGES) + 1, dtype=np.int64)
+        self.peaks = [SecondSeries() for _ in PACING_WINDOWS_MS]
+        self.head = np.zeros((2, 0))
+        self.tail = np.zeros((2, 0))
+
+    def add(self, times: np.ndarray, lengths: np.ndarray):
+        """Adds packets sent after the ones added before."""
+        order = np.argsort(times, kind="stable")
+        packets = np.stack([times[order], lengths[order]]).astype(np.float64)
+        added = Pacing()
+        added.packets = packets.shape[1]
+        added.gaps = _gap_counts(np.diff(packets[0]))
+        added.add_peaks(packets, packets.shape[1])
+        longest = max(PACING_WINDOWS_MS) / 1000
+        added.head = packets[:, packets[0] < packets[0, 0] + longest]
+        added.tail = packets[:, packets[0] > packets[0, -1] - longest]
+        self.merge(added)
+
+    def add_peaks(self, packets: np.ndarray, count: int):
+        """Raises the peaks by the windows starting at the first packets of the sorted rows."""
+        times = packets[0]
+        totals = np.concatenate([[0], np.cumsum(packets[1])])
+        starts = np.arange(count)
+        seconds = np.floor(times[:count]).astype(np.int64)
+        for peaks, window in zip(self.peaks, PACING_WINDOWS_MS):
+            ends = np.searchsorted(times, times[:count] + window / 1000, side="left")
+            peaks.maximum(seconds, (totals[ends] - totals[starts]).astype(np.int64))
+
+    def take(self) -> "Pacing":
+        """Returns what was counted since the last call, and counts anew."""
+        taken = Pacing()
+        taken.packets, taken.gaps, taken.peaks = self.packets, self.gaps, self.peaks
+        taken.head, taken.tail = self.head, self.tail
+        self.packets = 0
+        self.gaps = np.zeros_like(taken.gaps)
+        self.peaks = [SecondSeries() for _ in PACING_WINDOWS_MS]
+        self.head = self.tail = np.zeros((2, 0))
+        return taken
+
+    def merge(self, other: "Pacing"):
+        """Adds what was counted for packets sent after the ones counted before."""
+        if other.packets == 0:
+            return
+        if self.tail.shape[1] > 0 and other.head.shape[1] > 0:
+            self.gaps += _gap_counts(other.head[0, :1] - self.tail[0, -1:])
+            self.add_peaks(np.concatenate([self.tail, other.head], axis=1), self.tail.shape[1])
+        longest = max(PACING_WINDOWS_MS) / 1000
+        if self.packets == 0:
+            self.head = other.head
+        elif self.head.shape[1] > 0:
+            head = np.concatenate([self.head, other.head], axis=1)
+            self.head = head[:, head[0] < head[0, 0] + longest]
+        if other.tail.shape[1] > 0:
+            tail = np.concatenate([self.tail, other.tail], axis=1)
+            self.tail = tail[:, tail[0] > tail[0, -1] - longest]
+        self.packets += other.packets
+        self.gaps += other.gaps
+        for peaks, other_peaks in zip(self.peaks, other.peaks):
+            seconds = other_peaks.seconds()
+            if len(seconds) > 0:
+                peaks.maximum(seconds, other_peaks.values(seconds))
+
+
+def _gap_counts(gaps: np.ndarray) -> np.ndarray:
+    return np.bincount(np.searchsorted(GAP_BIN_EDGES, gaps, side="right"), minlength=len(GAP_BIN_EDGES) + 1)
+
+
+class SecondSeries:
+    """The highest value seen per second, of the seconds seen."""
+
+    def __init__(self):
+        self._values: dict[int, int] = {}
+
+    def maximum(self, seconds: np.ndarray, values: np.ndarray):
+        """Raises the values of the seconds to the given values, where those are higher."""
+        unique_seconds, indexes = np.unique(seconds, return_inverse=True)
+        highest = np.zeros(len(unique_seconds), dtype=np.int64)
+        np.maximum.at(highest, indexes.reshape(-1), values)
+        for second, value in zip(unique_seconds.tolist(), highest.tolist()):
+            if value > self._values.get(second, 0):
+                self._values[second] = value
+
+    def seconds(self) -> np.ndarray:
+        return np.array(sorted(self._values), dtype=np.int64)
+
+    def values(self, seconds: range | np.ndarray) -> np.ndarray:
+        return np.array(
+            [self._values.get(second, 0) for second in np.asarray(seconds).tolist()], dtype=np.int64
+        )
@@ -0,0 +1,372 @@
+import math
+import mmap
+import os
+import struct
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO
+
+import numpy as np
+
+from .traffic_shaper import PROTOCOL_NUMBERS
+from .traffic_shaper import Protocol
+
+SNAPSHOT_LENGTH = 128
+READ_SIZE = 4 * 1024 * 1024
+MINIMUM_RANGE_SIZE = 32 * 1024 * 1024
+RECORD_SEARCH_SIZE = 1024 * 1024
+RECORD_CHAIN_LENGTH = 16
+RECORD_WINDOW_SIZE = 16 + 96
+DATAGRAM_WINDOW_SIZE = 8 + 16 + 64
+PROTOCOLS = {number: protocol for protocol, number in PROTOCOL_NUMBERS.items()}
+PCAP_MAGIC_MICROSECONDS = 0xA1B2C3D4
+PCAP_MAGIC_NANOSECONDS = 0xA1B23C4D
+LINK_TYPE_NULL = 0
+LINK_TYPE_ETHERNET = 1
+ETHERNET_TYPE_IPV4 = 0x0800
+ETHERNET_TYPE_IPV6 = 0x86DD
+ETHERNET_TYPE_VLAN = 0x8100
+NULL_FAMILY_IPV4 = 2
+NULL_FAMILY_IPV6 = 30
+
+
+@dataclass
+class PacketTable:
+    timestamps: np.ndarray
+    protocols: np.ndarray
+    source_ports: np.ndarray
+    destination_ports: np.ndarray
+    lengths: np.ndarray
+    # The first bytes of UDP datagrams, starting with the UDP header, and how many of them
+    # were captured. Zero for other packets.
+    datagrams: np.ndarray
+    datagram_lengths: np.ndarray
+    # TCP header fields and payload lengths. Zero for other packets. Only the lowest 32 bits
+    # of IPv6 addresses are kept.
+    source_addresses: np.ndarray
+    destination_addresses: np.ndarray
+    sequence_numbers: np.ndarray
+    acknowledgement_numbers: np.ndarray
+    tcp_flags: np.ndarray
+    payload_lengths: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+
+class MappedCapture:
+    """A memory mapped pcap file, remapped when it grows while being captured to."""
+
+    def __init__(self, file: Path):
+        self._file = file
+        self._fin: BinaryIO | None = None
+        self._mapping: mmap.mmap | None = None
+        self._released = 0
+        self.endian = "<"
+        self.resolution = 1e6
+        self.snapshot_length = SNAPSHOT_LENGTH
+        self.link_type = LINK_TYPE_ETHERNET
+
+    def __enter__(self):
+        self._fin = self._file.open("rb")
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._unmap()
+        if self._fin is not None:
+            self._fin.close()
+            self._fin = None
+
+    def data(self) -> mmap.mmap:
+        if self._mapping is None:
+            raise Exception("The network capture is not mapped.")
+        return self._mapping
+
+    def remap(self) -> bool:
+        if self._fin is None:
+            return False
+        size = os.fstat(self._fin.fileno()).st_size
+        if size < 24 or (self._mapping is not None and size <= len(self._mapping)):
+            return False
+        self._unmap()
+        self._mapping = mmap.mmap(self._fin.fileno(), size, access=mmap.ACCESS_READ)
+        if hasattr(mmap, "MADV_SEQUENTIAL"):
+            self._mapping.madvise(mmap.MADV_SEQUENTIAL)
+        self.endian, self.resolution = pcap_format(self._mapping[:24])
+        self.snapshot_length, self.link_type = struct.unpack_from(f"{self.endian}II", self._mapping, 16)
+        self._released = 0
+        return True
+
+    def release(self, offset: int):
+        end = offset - offset % mmap.PAGESIZE
+        if self._mapping is None or end - self._released < READ_SIZE:
+            return
+        if hasattr(mmap, "MADV_DONTNEED"):
+            self._mapping.madvise(mmap.MADV_DONTNEED, self._released, end - self._released)
+        self._released = end
+
+    def _unmap(self):
+        if self._mapping is not None:
+            self._mapping.close()
+            self._mapping = None
+
+
+def scan_packet_tables(file: Path, start: int = 24, end: int | None = None, tcp: bool = False):
+    with MappedCapture(file) as capture:
+        offset = start
+        while capture.remap():
+            stop = len(capture.data()) if end is None else end
+            while offset < stop:
+                offsets, offset = find_records(
+                    capture.data(), capture.endian, offset, min(offset + READ_SIZE, stop)
+                )
+                if len(offsets) == 0:
+                    break
+                table = parse_packet_table(
+                    capture.link_type,
+                    capture.endian,
+                    capture.resolution,
+                    np.frombuffer(capture.data(), np.uint8),
+                    offsets,
+                    tcp,
+                )
+                yield table, offset
+                capture.release(offset)
+            if end is not None:
+                return
+
+
+def split_capture(file: Path, start: int = 24) -> list[tuple[int, int]]:
+    with MappedCapture(file) as capture:
+        if not capture.remap():
+            return []
+        end = len(capture.data())
+        if end <= start:
+            return []
+        size = end - start
+        parts = max(1, math.ceil(size / max(MINIMUM_RANGE_SIZE, size // (4 * (os.cpu_count() or 1)))))
+        starts = [start]
+        for part in range(1, parts):
+            record_start = find_record_start(capture, max(start + part * size // parts, starts[-1] + 1))
+            if record_start is None:
+                break
+            starts.append(record_start)
+        return list(zip(starts, starts[1:] + [end]))
+
+
+def find_record_start(capture: MappedCapture, offset: int) -> int | None:
+    data = capture.data()
+    end = min(offset + RECORD_SEARCH_SIZE, len(data))
+    for candidate in range(offset, end):
+        if is_record_chain(capture, candidate):
+            return candidate
+    return None
+
+
+def is_record_chain(capture: MappedCapture, offset: int) -> bool:
+    data = capture.data()
+    record_header = struct.Struct(f"{capture.endian}IIII")
+    first_seconds = record_header.unpack_from(data, 24)[0]
+    for _ in range(RECORD_CHAIN_LENGTH):
+        if offset == len(data):
+            return True
+        if offset + 16 > len(data):
+            return False
+        seconds, fraction, captured_length, original_length = record_header.unpack_from(data, offset)
+        if (
+            seconds < first_seconds
+            or fraction >= capture.resolution
+            or not 0 < captured_length <= min(original_length, capture.snapshot_length)
+        ):
+            return False
+        offset += 16 + captured_length
+    return True
+
+
+def find_records(buffer, endian: str, offset: int, stop: int) -> tuple[np.ndarray, int]:
+    unpack_captured_length = struct.Struct(f"{endian}I").unpack_from
+    length = len(buffer)
+    offsets: list[int] = []
+    append = offsets.append
+    while offset < stop and offset + 16 <= length:
+        end = offset + 16 + unpack_captured_length(buffer, offset + 8)[0]
+        if end > length:
+            break
+        append(offset)
+        offset = end
+    return np.array(offsets, dtype=np.int64), offset
+
+
+def parse_packet_table(
+    link_type: int,
+    endian: str,
+    resolution: float,
+    data: np.ndarray,
+    offsets: np.ndarray,
+    tcp: bool = False,
+) -> PacketTable:
+    """Parses the records at the offsets. TCP header fields are only parsed if tcp is set."""
+    windows = gather_windows(data, offsets, RECORD_WINDOW_SIZE)
+    seconds = read_field(windows, 0, f"{endian}u4")
+    fraction = read_field(windows, 4, f"{endian}u4")
+    captured_lengths = 16 + read_field(windows, 8, f"{endian}u4").astype(np.int64)
+    original_lengths = read_field(windows, 12, f"{endian}u4")
+    if link_type == LINK_TYPE_ETHERNET:
+        is_ip_v4, is_ip_v6, network = parse_ethernet_table(windows, captured_lengths)
+    elif link_type == LINK_TYPE_NULL:
+        is_ip_v4, is_ip_v6, network = parse_loopback_table(windows, captured_lengths)
+    else:
+        raise Exception(f"Unsupported network capture link type {link_type}.")
+    return parse_network_table(
+        data,
+        offsets,
+        windows,
+        captured_lengths,
+        is_ip_v4,
+        is_ip_v6,
+        network,
+        seconds + fraction / resolution,
+        original_lengths,
+        tcp,
+    )
+
+
+def parse_network_table(
+    data: np.ndarray,
+    offsets: np.ndarray,
+    windows: np.ndarray,
+    captured_lengths: np.ndarray,
+    is_ip_v4: np.ndarray,
+    is_ip_v6: np.ndarray,
+    network: np.ndarray,
+    timestamps: np.ndarray,
+    lengths: np.ndarray,
+    tcp: bool,
+) -> PacketTable:
+    """Parses the IP packets starting at the network columns of the windows, which were
+    gathered from the data at the offsets. Captured lengths are counted from the offsets.
+    """
+    is_ip_v4 &= captured_lengths >= network + 20
+    is_ip_v6 &= captured_lengths >= network + 40
+    protocols = np.where(is_ip_v4, read_field(windows, network + 9, "u1"), 0)
+    protocols = np.where(is_ip_v6, read_field(windows, network + 6, "u1"), protocols)
+    is_ip_v4 &= read_field(windows, network + 6, ">u2") & 0x1FFF == 0
+    transport = np.where(is_ip_v4, network + 4 * (read_field(windows, network, "u1") & 0x0F), network + 40)
+    valid = (is_ip_v4 | is_ip_v6) & np.isin(protocols, list(PROTOCOLS))
+    valid &= captured_lengths >= transport + 4
+    windows = windows[valid]
+    network = network[valid]
+    transport = transport[valid]
+    protocols = protocols[valid].astype(np.uint8)
+    is_udp = protocols == PROTOCOL_NUMBERS[Protocol.UDP]
+    datagrams = np.zeros((len(windows), DATAGRAM_WINDOW_SIZE), dtype=np.uint8)
+    datagrams[is_udp] = gather_windows(data, offsets[valid][is_udp] + transport[is_udp], DATAGRAM_WINDOW_SIZE)
+    datagram_lengths = np.minimum(
+        read_field(windows, transport + 4, ">u2"), captured_lengths[valid] - transport
+    )
+    segments = np.flatnonzero(protocols == PROTOCOL_NUMBERS[Protocol.TCP]) if tcp else np.zeros(0, np.int64)
+    return PacketTable(
+        timestamps=timestamps[valid],
+        protocols=protocols,
+        source_ports=read_field(windows, transport, ">u2"),
+        destination_ports=read_field(windows, transport + 2, ">u2"),
+        lengths=lengths[valid],
+        datagrams=datagrams,
+        datagram_lengths=np.where(is_udp, datagram_lengths, 0),
+        **parse_tcp_table(
+            windows, segments, is_ip_v4[valid][segments], network[segments], transport[segments]
+        ),
+    )
+
+
+def parse_tcp_table(
+    windows: np.ndarray, rows: np.ndarray, is_ip_v4: np.ndarray, network: np.ndarray, transport: np.ndarray
+) -> dict[str, np.ndarray]:
+    ip_lengths = np.where(
+        is_ip_v4,
+        read_field(windows, network + 2, ">u2", rows),
+        read_field(windows, network + 4, ">u2", rows).astype(np.int64) + 40,
+    )
+    header_lengths = 4 * (read_field(windows, transport + 12, "u1", rows) >> 4)
+    fields = {
+        "source_addresses": read_field(windows, np.where(is_ip_v4, network + 12, network + 20), ">u4", rows),
+        "destination_addresses": read_field(
+            windows, np.where(is_ip_v4, network + 16, network + 36), ">u4", rows
+        ),
+        "sequence_numbers": read_field(windows, transport + 4, ">u4", rows),
+        "acknowledgement_numbers": read_field(windows, transport + 8, ">u4", rows),
+        "tcp_flags": read_field(windows, transport + 13, "u1", rows),
+        "payload_lengths": np.maximum(ip_lengths - (transport - network) - header_lengths, 0),
+    }
+    table = {name: np.zeros(len(windows), dtype=np.uint32) for name in fields}
+    table["tcp_flags"] = np.zeros(len(windows), dtype=np.uint8)
+    for name, values in fields.items():
+        table[name][rows] = values
+    return table
+
+
+def parse_ethernet_table(
+    windows: np.ndarray, captured_lengths: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    ethernet_types = read_field(windows, 16 + 12, ">u2")
+    is_vlan = ethernet_types == ETHERNET_TYPE_VLAN
+    ethernet_types = np.where(is_vlan, read_field(windows, 16 + 16, ">u2"), ethernet_types)
+    network = np.where(is_vlan, 16 + 18, 16 + 14)
+    valid = captured_lengths >= network
+    return (
+        valid & (ethernet_types == ETHERNET_TYPE_IPV4),
+        valid & (ethernet_types == ETHERNET_TYPE_IPV6),
+        network,
+    )
+
+
+def parse_loopback_table(
+    windows: np.ndarray, captured_lengths: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    families = read_field(windows, 16, "=u4")
+    valid = captured_lengths >= 16 + 4
+    return (
+        valid & (families == NULL_FAMILY_IPV4),
+        valid & (families == NULL_FAMILY_IPV6),
+        np.full(len(windows), 16 + 4),
+    )
+
+
+def gather_windows(data: np.ndarray, offsets: np.ndarray, size: int) -> np.ndarray:
+    windows = np.zeros((len(offsets), size), dtype=np.uint8)
+    whole = offsets + size <= len(data)
+    if len(data) >= size:
+        starts = np.ndarray(shape=(len(data) - size + 1,), dtype=(np.void, size), buffer=data, strides=(1,))
+        windows[whole] = starts[offsets[whole]].view(np.uint8).reshape(-1, size)
+    for row in np.flatnonzero(~whole).tolist():
+        tail = data[offsets[row] :]
+        windows[row, : len(tail)] = tail
+    return windows
+
+
+def read_field(
+    windows: np.ndarray, columns: np.ndarray | int, dtype: str, rows: np.ndarray | None = None
+) -> np.ndarray:
+    value_type = np.dtype(dtype)
+    count, size = windows.shape
+    if rows is None:
+        rows = np.arange(count)
+    if count == 0 or len(rows) == 0:
+        return np.zeros(0, dtype=value_type)
+    values = np.ndarray(
+        shape=(count * size - value_type.itemsize + 1,),
+        dtype=value_type,
+        buffer=windows,
+        strides=(1,),
+    )
+    return values[rows * size + np.clip(columns, 0, size - value_type.itemsize)]
+
+
+def pcap_format(header: bytes) -> tuple[str, float]:
+    for endian in ["<", ">"]:
+        magic = struct.unpack_from(f"{endian}I", header, 0)[0]
+        if magic == PCAP_MAGIC_MICROSECONDS:
+            return endian, 1e6
+        if magic == PCAP_MAGIC_NANOSECONDS:
+            return endian, 1e9
+    raise Exception("Not a pcap file.")
@@ -0,0 +1,171 @@
+import mmap
+import select
+import socket
+import struct
+import threading
+from collections.abc import Callable
+
+import numpy as np
+
+from .pcap import PacketTable
+from .pcap import gather_windows
+from .pcap import parse_network_table
+from .pcap import read_field
+
+SOL_PACKET = 263
+PACKET_RX_RING = 5
+PACKET_VERSION = 10
+TPACKET_V3 = 2
+ETH_P_ALL = 0x0003
+ARPHRD_LOOPBACK = 772
+PACKET_OUTGOING = 4
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+RING_BLOCK_SIZE = 1024 * 1024
+RING_BLOCK_COUNT = 64
+RING_FRAME_SIZE = 2048
+RING_BLOCK_TIMEOUT_MS = 100
+TPACKET3_HEADER_SIZE = 48
+# The first bytes of each packet that are parsed, from its IP header on.
+RING_WINDOW_SIZE = 96
+
+
+class RingCapture:
+    """Counts packet bytes per stream and second from an AF_PACKET TPACKET_V3 ring. Linux only."""
+
+    def __init__(
+        self,
+        interface: str,
+        hosts: list[str],
+        add_packets: Callable[[PacketTable], None],
+        lock: threading.Lock,
+    ):
+        self.interface = interface
+        self.total_bytes = 0
+        self._addresses = resolve_addresses(hosts)
+        self._add_packets = add_packets
+        self._lock = lock
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._capture, daemon=True)
+        self._socket = open_ring_socket(interface)
+        self._ring = mmap.mmap(self._socket.fileno(), RING_BLOCK_SIZE * RING_BLOCK_COUNT)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        # The ring is only unmapped once the capture no longer reads it, which is within a
+        # block timeout.
+        self._thread.join()
+        self._ring.close()
+        self._socket.close()
+
+    def is_running(self) -> bool:
+        return self._thread.is_alive()
+
+    def _capture(self):
+        poller = select.poll()
+        poller.register(self._socket, select.POLLIN | select.POLLERR)
+        block = 0
+        while not self._stopped.is_set():
+            offset = block * RING_BLOCK_SIZE
+            if not struct.unpack_from("=I", self._ring, offset + 8)[0] & TP_STATUS_USER:
+                poller.poll(RING_BLOCK_TIMEOUT_MS)
+                continue
+            table = self._read_block(offset)
+            struct.pack_into("=I", self._ring, offset + 8, TP_STATUS_KERNEL)
+            block = (block + 1) % RING_BLOCK_COUNT
+            with self._lock:
+                self._add_packets(table)
+            self.total_bytes += int(table.lengths.sum())
+
+    def _read_block(self, offset: int) -> PacketTable:
+        data = np.frombuffer(self._ring, dtype=np.uint8)
+        positions = self._find_packets(offset)
+        headers = gather_windows(data, positions, TPACKET3_HEADER_SIZE + 11)
+        mac = read_field(headers, 24, "=u2").astype(np.int64)
+        network = read_field(headers, 26, "=u2").astype(np.int64)
+        # Loopback packets are seen both when sent and when received.
+        is_received = (read_field(headers, TPACKET3_HEADER_SIZE + 8, "=u2") != ARPHRD_LOOPBACK) | (
+            read_field(headers, TPACKET3_HEADER_SIZE + 10, "u1") != PACKET_OUTGOING
+        )
+        offsets = positions + network
+        windows = gather_windows(data, offsets, RING_WINDOW_SIZE)
+        captured_lengths = mac + read_field(headers, 12, "=u4").astype(np.int64) - network
+        versions = read_field(windows, 0, "u1") >> 4
+        is_ip_v4 = is_received & (captured_lengths > 0) & (versions == 4)
+        is_ip_v6 = is_received & (captured_lengths > 0) & (versions == 6)
+        if self._addresses:
+            is_ip_v4 &= self._is_host_packet(windows, 12, 4)
+            is_ip_v6 &= self._is_host_packet(windows, 8, 16)
+        return parse_network_table(
+            data,
+            offsets,
+            windows,
+            captured_lengths,
+            is_ip_v4,
+            is_ip_v6,
+            np.zeros(len(positions), dtype=np.int64),
+            read_field(headers, 4, "=u4") + read_field(headers, 8, "=u4") / 1e9,
+            read_field(headers, 16, "=u4"),
+            True,
+        )
+
+    def _find_packets(self, offset: int) -> np.ndarray:
+        """The positions of the packets of a block, which are chained by their offsets."""
+        unpack_next_offset = struct.Struct("=I").unpack_from
+        count, position = struct.unpack_from("=II", self._ring, offset + 12)
+        position += offset
+        positions: list[int] = []
+        append = positions.append
+        for _ in range(count):
+            append(position)
+            position += unpack_next_offset(self._ring, position)[0]
+        return np.array(positions, dtype=np.int64)
+
+    def _is_host_packet(self, windows: np.ndarray, column: int, size: int) -> np.ndarray:
+        sources = windows[:, column : column + size]
+        destinations = windows[:, column + size : column + 2 * size]
+        found = np.zeros(len(windows), dtype=bool)
+        for address in [address for address in self._addresses if len(address) == size]:
+            host = np.frombuffer(address, dtype=np.uint8)
+            found |= (sources == host).all(axis=1) | (destinations == host).all(axis=1)
+        return found
+
+
+def open_ring_socket(interface: str) -> socket.socket:
+    try:
+        ring_socket = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+    except (AttributeError, PermissionError) as error:
+        raise Exception(f"Capturing packets in memory on {interface} is not allowed. {error}") from None
+    try:
+        ring_socket.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+        ring_socket.setsockopt(
+            SOL_PACKET,
+            PACKET_RX_RING,
+            struct.pack(
+                "=7I",
+                RING_BLOCK_SIZE,
+                RING_BLOCK_COUNT,
+                RING_FRAME_SIZE,
+                RING_BLOCK_SIZE * RING_BLOCK_COUNT // RING_FRAME_SIZE,
+                RING_BLOCK_TIMEOUT_MS,
+                0,
+                0,
+            ),
+        )
+        ring_socket.bind((interface, ETH_P_ALL))
+    except BaseException:
+        ring_socket.close()
+        raise
+    return ring_socket
+
+
+def resolve_addresses(hosts: list[str]) -> set[bytes]:
+    addresses = set()
+    for host in hosts:
+        for family, _, _, _, address in socket.getaddrinfo(host, None):
+            if family in [socket.AF_INET, socket.AF_INET6]:
+                addresses.add(socket.inet_pton(family, str(address[0])))
+    return addresses
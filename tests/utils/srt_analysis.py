@@ -0,0 +1,60 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+from .pcap import DATAGRAM_WINDOW_SIZE
+from .pcap import read_field
+
+SRT_CONTROL_ACK = 2
+SRT_CONTROL_NAK = 3
+SRT_RETRANSMITTED = 0x04000000
+SRT_COUNTERS = ["packets", "retransmitted", "nak_ranges", "acks", "rtt", "capacities", "capacity"]
+
+
+@dataclass
+class SrtSeries:
+    name: str
+    slot: int
+    packets: list[int]
+    retransmitted_packets: list[int]
+    nak_ranges: list[int]
+    rtts: list[float]
+    link_capacities: list[float]
+
+    def metrics(self) -> dict[str, list]:
+        return {
+            "SRT packets sent per second": self.packets,
+            "SRT retransmitted packets per second": self.retransmitted_packets,
+            "SRT NAKed ranges per second": self.nak_ranges,
+            "SRT ACK RTT in ms": self.rtts,
+            "SRT estimated link capacity in packets per second": self.link_capacities,
+        }
+
+
+def count_srt(datagrams: np.ndarray, lengths: np.ndarray) -> dict[str, np.ndarray]:
+    """Counts SRT data and control packets from their UDP datagrams, per packet."""
+    header = read_field(datagrams, 8, ">u4")
+    is_header = lengths >= 8 + 16
+    is_data = is_header & (header >> 31 == 0)
+    is_control = is_header & (header >> 31 == 1)
+    control_types = (header >> 16) & 0x7FFF
+    message_numbers = read_field(datagrams, 12, ">u4")
+    is_ack = is_control & (control_types == SRT_CONTROL_ACK) & (lengths >= 8 + 16 + 8)
+    is_full_ack = is_ack & (lengths >= 8 + 16 + 24)
+    is_nak = is_control & (control_types == SRT_CONTROL_NAK)
+    # A loss list entry is either a sequence number, or a range of two where the first has the
+    # highest bit set.
+    words = np.clip((lengths.astype(np.int64) - 8 - 16) // 4, 0, (DATAGRAM_WINDOW_SIZE - 8 - 16) // 4)
+    range_ends = np.zeros(len(datagrams), dtype=np.int64)
+    for word in range(1, (DATAGRAM_WINDOW_SIZE - 8 - 16) // 4):
+        is_range_start = read_field(datagrams, 8 + 16 + 4 * (word - 1), ">u4") >> 31 == 1
+        range_ends += (word < words) & is_range_start
+    return {
+        "packets": is_data,
+        "retransmitted": is_data & (message_numbers & SRT_RETRANSMITTED != 0),
+        "nak_ranges": np.where(is_nak, words - range_ends, 0),
+        "acks": is_ack,
+        "rtt": np.where(is_ack, read_field(datagrams, 8 + 16 + 4, ">u4"), 0),
+        "capacities": is_full_ack,
+        "capacity": np.where(is_full_ack, read_field(datagrams, 8 + 16 + 20, ">u4"), 0),
+    }
@@ -0,0 +1,112 @@
+import math
+from dataclasses import dataclass
+
+import numpy as np
+
+TCP_FLAG_ACK = 0x10
+TCP_OUT_OF_ORDER_TIME = 0.003
+TCP_COUNTERS = ["segments", "retransmitted", "out_of_order", "rtt_samples", "rtt"]
+SEQUENCE_SPACE = 1 << 32
+
+
+@dataclass
+class TcpSeries:
+    name: str
+    slot: int
+    segments: list[int]
+    retransmitted_segments: list[int]
+    out_of_order_segments: list[int]
+    rtts: list[float]
+
+    def metrics(self) -> dict[str, list]:
+        return {
+            "TCP segments with data per second": self.segments,
+            "TCP retransmitted segments per second": self.retransmitted_segments,
+            "TCP out-of-order segments per second": self.out_of_order_segments,
+            "TCP data to ACK RTT in ms": self.rtts,
+        }
+
+
+class TcpFlow:
+    """One direction of a TCP connection. Finds retransmitted and out-of-order segments from
+    their sequence numbers, and RTT from when data is first seen until it is acknowledged.
+    """
+
+    def __init__(self):
+        self._last_sequence_number: int | None = None
+        self._last_position = 0
+        self._highest_end: int | None = None
+        self._highest_time = 0.0
+        self._highest_acknowledged = np.iinfo(np.int64).min
+        self._unacknowledged_ends = np.zeros(0, dtype=np.int64)
+        self._unacknowledged_times = np.zeros(0)
+        self._retransmission_times = np.zeros(0)
+
+    def add_segments(
+        self, times: np.ndarray, sequence_numbers: np.ndarray, lengths: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Returns which segments were retransmitted and which arrived out of order. Like
+        Wireshark, data seen before is out of order if the data after it was seen less than
+        3 ms earlier, and retransmitted otherwise.
+        """
+        if self._last_sequence_number is None:
+            self._last_sequence_number = int(sequence_numbers[0])
+        positions = self._last_position + np.cumsum(
+            sequence_steps(np.diff(sequence_numbers.astype(np.int64), prepend=self._last_sequence_number))
+        )
+        self._last_sequence_number = int(sequence_numbers[-1])
+        self._last_position = int(positions[-1])
+        ends = positions + lengths
+        if self._highest_end is None:
+            self._highest_end = int(positions[0])
+            self._highest_time = float(times[0])
+        highest_ends = np.maximum.accumulate(np.concatenate([[self._highest_end], ends]))
+        highest_times = np.concatenate([[self._highest_time], times])
+        is_old = positions < highest_ends[:-1]
+        passed_times = highest_times[np.searchsorted(highest_ends, positions, side="right")]
+        out_of_order = is_old & (times - passed_times < TCP_OUT_OF_ORDER_TIME)
+        retransmitted = is_old & ~out_of_order
+        self._highest_end = int(highest_ends[-1])
+        self._highest_time = float(highest_times[np.searchsorted(highest_ends, highest_ends[-1])])
+        self._unacknowledged_ends = np.concatenate([self._unacknowledged_ends, ends[~is_old]])
+        self._unacknowledged_times = np.concatenate([self._unacknowledged_times, times[~is_old]])
+        self._retransmission_times = np.concatenate([self._retransmission_times, times[retransmitted]])
+        return retransmitted, out_of_order
+
+    def add_acknowledgements(
+        self, times: np.ndarray, acknowledgement_numbers: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Returns when and what RTT was measured, from each acknowledgement of new data. Data
+        retransmitted before it was acknowledged is not measured.
+        """
+        if self._last_sequence_number is None or len(times) == 0:
+            return np.zeros(0), np.zeros(0)
+        positions = self._last_position + sequence_steps(
+            acknowledgement_numbers.astype(np.int64) - self._last_sequence_number
+        )
+        highest = np.maximum.accumulate(np.concatenate([[self._highest_acknowledged], positions]))[:-1]
+        indexes = np.searchsorted(self._unacknowledged_ends, positions, side="right") - 1
+        measured = (positions > highest) & (indexes >= 0)
+        indexes = np.maximum(indexes, 0)
+        if len(self._unacknowledged_ends) == 0:
+            measured[:] = False
+        else:
+            sent_times = self._unacknowledged_times[indexes]
+            measured &= (self._unacknowledged_ends[indexes] > highest) & (sent_times <= times)
+            retransmissions = np.searchsorted(self._retransmission_times, times) - np.searchsorted(
+                self._retransmission_times, sent_times
+            )
+            measured &= retransmissions == 0
+        rtts = times[measured] - self._unacknowledged_times[indexes[measured]]
+        self._highest_acknowledged = max(self._highest_acknowledged, int(positions.max()))
+        unacknowledged = self._unacknowledged_ends > self._highest_acknowledged
+        self._unacknowledged_ends = self._unacknowledged_ends[unacknowledged]
+        self._unacknowledged_times = self._unacknowledged_times[unacknowledged]
+        oldest = self._unacknowledged_times[0] if len(self._unacknowledged_times) > 0 else math.inf
+        self._retransmission_times = self._retransmission_times[self._retransmission_times >= oldest]
+        return times[measured], rtts
+
+
+def sequence_steps(differences: np.ndarray) -> np.ndarray:
+    """The shortest signed steps between 32 bit sequence numbers, which wrap around."""
+    return (differences + SEQUENCE_SPACE // 2) % SEQUENCE_SPACE - SEQUENCE_SPACE // 2
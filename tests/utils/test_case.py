@@ -1,46 +1,64 @@
 import logging
-import re
+import math
 import statistics
-import subprocess
 import time
+from collections import deque
 from collections.abc import Callable
-from concurrent.futures import ThreadPoolExecutor
+from collections.abc import Sequence
 from dataclasses import dataclass
 from datetime import UTC
 from datetime import datetime
 from fractions import Fraction
 from pathlib import Path
 
+import numpy as np
 import systest
 
 from .config import Capability
+from .decoder import AudioFramesAnalyzer
+from .decoder import AudioTimecode
+from .decoder import AudioTimecodesAnalyzer
+from .decoder import FrameAnalyzer
+from .decoder import QrCropsAnalyzer
+from .decoder import UniqueFramesAnalyzer
+from .decoder import VideoFramesAnalyzer
+from .decoder import decode_recording
+from .decoder import read_video_timecodes
 from .ffmpeg import FfmpegVideoCodec
 from .ffmpeg import FfprobeAudioOutput
 from .ffmpeg import FfprobeFormatOutput
 from .ffmpeg import FfprobeVideoOutput
 from .ffmpeg import QrCode
 from .ffmpeg import detect_silence
-from .ffmpeg import extract_ltc_wav
 from .ffmpeg import ffprobe
 from .ffmpeg import ffprobe_audio
-from .ffmpeg import ffprobe_format
-from .ffmpeg import ffprobe_video
 from .ffmpeg import ffprobe_video_size
 from .ffmpeg import measure_mean_volume
-from .ffmpeg import read_qr_codes
-from .ffmpeg import read_unique_frame_presentation_time_stamps
-from .ffmpeg import read_video_timecodes
 from .moblin import Moblin
-from .utils import FILES_DIR
 from .utils import Crop
 from .utils import Image
 from .utils import Range
 from .utils import wait_until
 
 LOGGER = logging.getLogger(__name__)
-RE_LTCDUMP = re.compile(r"\S+\s+00:(\d+):(\d+):.*")
 CHANNEL_LAYOUTS = {1: "mono", 2: "stereo"}
 AUDIO_SAMPLES_PER_FRAME = 1024
+# Like the audio of FfmpegTestStream, generated by ltcgen.
+LTC_FPS = 30
+# The SEI timecode offsets from the presentation time stamps are counted in bins this wide, and
+# this far around the first offset.
+TIMECODE_OFFSET_RESOLUTION = 0.001
+TIMECODE_OFFSET_RANGE = 10.0
+QR_CODE_CROP = Crop(x=150, y=0, width=400, height=400)
+# Presentation time stamp gaps closer than this to each other are reported as one event.
+GAP_EVENT_SEPARATION = 1.0
+# Names of gap sizes, by the number of frames missing in them.
+GAP_SIZE_CLASSES = [
+    ("irregular", -math.inf, 1),
+    ("of 1 frame", 1, 2),
+    ("of 2 to 4 frames", 2, 5),
+    ("of 5 or more frames", 5, math.inf),
+]
 
 
 class TestCase(systest.TestCase):
@@ -142,27 +160,37 @@ class TestCase(systest.TestCase):
         self._assert_audio(probe, recording, channels)
 
     def assert_timecodes(self, recording: Path, start: datetime, end: datetime, fps: int = 30):
-        timecodes = read_video_timecodes(recording)
-        first = next((index for index, timecode in enumerate(timecodes) if timecode is not None), None)
-        if first is None:
-            raise Exception("No SEI timecodes in the stream.")
-        self.assert_less(first, 2 * fps, "Frames before the first SEI timecode.")
-        present = [timecode for timecode in timecodes[first:] if timecode is not None]
-        self.assert_equal(len(present), len(timecodes) - first, "Frames with a SEI timecode.")
-        offsets = []
-        for timecode in present:
+        frames = 0
+        first = None
+        offsets = OffsetHistogram(TIMECODE_OFFSET_RESOLUTION, TIMECODE_OFFSET_RANGE)
+        first_offsets: list[float] = []
+        last_offsets: deque[float] = deque(maxlen=fps)
+        for index, timecode in enumerate(read_video_timecodes(recording)):
+            frames += 1
+            if timecode is None:
+                continue
+            if first is None:
+                self.assert_less(index, 2 * fps, "Frames before the first SEI timecode.")
+                first = index
             self.assert_less(timecode.frame, fps, "SEI timecode frame number.")
             timecode_time = anchor_time_of_day(timecode.time_of_day(fps), start)
             self.assert_greater(timecode_time, start.timestamp() - 2, "SEI timecode before the stream.")
             self.assert_less(timecode_time, end.timestamp() + 2, "SEI timecode after the stream.")
-            offsets.append(timecode_time - timecode.pts)
-        median = statistics.median(offsets)
-        spread = max(abs(offset - median) for offset in offsets)
-        drift = statistics.median(offsets[-fps:]) - statistics.median(offsets[:fps])
+            offset = timecode_time - timecode.pts
+            offsets.add(offset)
+            if len(first_offsets) < fps:
+                first_offsets.append(offset)
+            last_offsets.append(offset)
+        if first is None:
+            raise Exception("No SEI timecodes in the stream.")
+        self.assert_equal(offsets.count, frames - first, "Frames with a SEI timecode.")
+        median = offsets.median()
+        spread = max(offsets.maximum - median, median - offsets.minimum)
+        drift = statistics.median(last_offsets) - statistics.median(first_offsets)
         LOGGER.debug(
             "SEI timecodes: %s of %s frames, spread %.3f s, drift %.3f s",
-            len(present),
-            len(timecodes),
+            offsets.count,
+            frames,
             spread,
             drift,
         )
@@ -203,7 +231,12 @@ class TestCase(systest.TestCase):
         raise Exception(f"Pixel at {position} is {image.pixel(*position)}, but expected it to be black.")
 
     def assert_not_all_black(self, image: Image, minimum_ratio: float = 0.01):
-        self.assert_greater(image.non_black_ratio(), minimum_ratio)
+        red, green, blue = image.mean_color()
+        self.assert_greater(
+            image.non_black_ratio(),
+            minimum_ratio,
+            f"Non-black pixels ratio, with the average color ({red:.0f}, {green:.0f}, {blue:.0f})",
+        )
 
     def wait_until(self, check: Callable[[], bool]):
         wait_until(check, "condition to be true")
@@ -222,11 +255,9 @@ class TestCase(systest.TestCase):
         self.assert_equal(video.width, width)
         self.assert_equal(video.height, height)
         self.assert_fps(video.average_fps, fps)
-        self.assert_presentation_time_stamps(
-            recording, 1 / fps, [frame.pts for frame in video.frames], "video"
-        )
+        self.assert_presentation_time_stamps(recording, 1 / fps, video.frames.pts, "video")
         self._assert_video_frame_numbers_increasing(probe.qr_codes)
-        picture_types = {frame.picture_type for frame in video.frames}
+        picture_types = set(video.frames.picture_types.decode())
         self.assert_equal(len(picture_types), 3)
         self.assert_in("I", picture_types)
         self.assert_in("P", picture_types)
@@ -255,15 +286,16 @@ class TestCase(systest.TestCase):
         self.assert_less(audio.bit_rate, 136_000)
         self._assert_audio_presentation_time_stamps(recording, audio)
         self._assert_audio_time_codes(probe.audio_time_codes)
-        for frame in audio.frames:
-            self.assert_equal(frame.channels, channels)
-            self.assert_equal(frame.number_of_samples, AUDIO_SAMPLES_PER_FRAME)
+        for frame_channels in set(audio.frames.channels):
+            self.assert_equal(frame_channels, channels)
+        for number_of_samples in set(audio.frames.number_of_samples):
+            self.assert_equal(number_of_samples, AUDIO_SAMPLES_PER_FRAME)
 
     def _assert_audio_presentation_time_stamps(self, recording: Path, audio: FfprobeAudioOutput):
         self.assert_presentation_time_stamps(
             recording,
             AUDIO_SAMPLES_PER_FRAME / audio.sample_rate,
-            [frame.pts for frame in audio.frames],
+            audio.frames.pts,
             "audio",
         )
 
@@ -271,24 +303,19 @@ class TestCase(systest.TestCase):
         self,
         recording: Path,
         expected_delta: float,
-        presentation_time_stamps: list[float],
+        presentation_time_stamps: Sequence[float],
         name: str,
         delta_error: float = 0.002,
     ):
         self.assert_greater(len(presentation_time_stamps), 0)
-        missing_presentation_time_stamps = find_missing_presentation_time_stamps(
-            expected_delta, presentation_time_stamps, delta_error
-        )
-        if len(missing_presentation_time_stamps) > 0:
+        gaps = find_presentation_time_stamp_gaps(expected_delta, presentation_time_stamps, delta_error)
+        if len(gaps) > 0:
             LOGGER.info(
                 'Watch video: mpv --osd-msg1="PTS: \\${time-pos/full}" %s',
                 recording.absolute(),
             )
-            for time_stamp, delta in missing_presentation_time_stamps:
-                LOGGER.info("%s: Missing PTS: %s (Delta: %s)", name, time_stamp, delta)
-        self.assert_equal(
-            len(missing_presentation_time_stamps), 0, f"for {name}. Expected delta: {expected_delta}"
-        )
+            gaps.log(name)
+        self.assert_equal(len(gaps), 0, f"for {name}. Expected delta: {expected_delta}")
 
     def _assert_video_frame_numbers_increasing(self, qr_codes: list[QrCode] | None):
         if qr_codes is None:
@@ -309,33 +336,70 @@ class TestCase(systest.TestCase):
                 bad_frame_numbers = True
         self.assert_false(bad_frame_numbers)
 
-    def _assert_audio_time_codes(self, output: str | None):
-        if output is None:
+    def _assert_audio_time_codes(self, timecodes: list[AudioTimecode] | None):
+        if timecodes is None:
             return
         has_seen_start_time = False
         has_seen_end_time = False
-        for line in output.splitlines():
-            mo = RE_LTCDUMP.match(line)
-            if mo:
-                seconds = 60 * int(mo.group(1)) + int(mo.group(2))
+        for timecode in timecodes:
+            if timecode.discontinuity and has_seen_start_time and not has_seen_end_time:
+                self._log_audio_time_codes(timecodes)
+                raise Exception("Discontinuity in audio!")
+            if timecode.hours == 0:
+                seconds = 60 * timecode.minutes + timecode.seconds
                 if 2 <= seconds <= 3:
                     has_seen_start_time = True
                 if 9 <= seconds <= 10:
                     has_seen_end_time = True
-            elif "#DISCONTINUITY" in line:
-                if has_seen_start_time and not has_seen_end_time:
-                    self._log_output(output)
-                    raise Exception("Discontinuity in audio!")
         if not has_seen_start_time:
-            self._log_output(output)
+            self._log_audio_time_codes(timecodes)
             raise Exception("Start time not found in audio!")
         if not has_seen_end_time:
-            self._log_output(output)
+            self._log_audio_time_codes(timecodes)
             raise Exception("End time not found in audio!")
 
-    def _log_output(self, output: str):
-        for line in output.splitlines():
-            LOGGER.info("ltcdump: %s", line)
+    def _log_audio_time_codes(self, timecodes: list[AudioTimecode]):
+        for timecode in timecodes:
+            LOGGER.info(
+                "LTC: %02d:%02d:%02d:%02d at %.3f s%s",
+                timecode.hours,
+                timecode.minutes,
+                timecode.seconds,
+                timecode.frame,
+                timecode.pts,
+                " after a discontinuity" if timecode.discontinuity else "",
+            )
+
+
+class OffsetHistogram:
+    """Counts values in bins of fixed width around the first value, to estimate their median
+    with memory that does not grow with their number. Values further away than the range are
+    counted in the outermost bins. The smallest and largest values are kept exactly.
+    """
+
+    def __init__(self, resolution: float, value_range: float):
+        self.count = 0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+        self._resolution = resolution
+        self._half = round(value_range / resolution)
+        self._counts = np.zeros(2 * self._half + 1, dtype=np.int64)
+        self._center: float | None = None
+
+    def add(self, value: float):
+        if self._center is None:
+            self._center = value
+        index = round((value - self._center) / self._resolution) + self._half
+        self._counts[min(max(index, 0), len(self._counts) - 1)] += 1
+        self.count += 1
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+
+    def median(self) -> float:
+        if self._center is None:
+            raise Exception("No values to get the median of.")
+        index = int(np.searchsorted(np.cumsum(self._counts), (self.count + 1) / 2))
+        return self._center + (index - self._half) * self._resolution
 
 
 def anchor_time_of_day(seconds: float, start: datetime) -> float:
@@ -353,7 +417,7 @@ class RecordingProbe:
     audio: FfprobeAudioOutput
     qr_codes: list[QrCode] | None
     unique_frame_presentation_time_stamps: list[list[float]]
-    audio_time_codes: str | None
+    audio_time_codes: list[AudioTimecode] | None
 
 
 def probe_recording(
@@ -363,52 +427,113 @@ def probe_recording(
     has_audio_time_codes: bool,
 ) -> RecordingProbe:
     crops = duplicated_frames_crops if duplicated_frames_crops is not None else [None]
-    with ThreadPoolExecutor() as executor:
-        format_future = executor.submit(ffprobe_format, recording)
-        video_future = executor.submit(ffprobe_video, recording)
-        audio_future = executor.submit(ffprobe_audio, recording)
-        qr_codes_future = executor.submit(_read_qr_codes, recording, has_qr_codes)
-        unique_frames_futures = [
-            executor.submit(read_unique_frame_presentation_time_stamps, recording, crop) for crop in crops
+    video = VideoFramesAnalyzer()
+    audio = AudioFramesAnalyzer()
+    unique_frames = [UniqueFramesAnalyzer(crop) for crop in crops]
+    qr_codes = QrCropsAnalyzer(QR_CODE_CROP) if has_qr_codes else None
+    audio_time_codes = AudioTimecodesAnalyzer(LTC_FPS) if has_audio_time_codes else None
+    analyzers: list[FrameAnalyzer] = [video, audio, *unique_frames]
+    analyzers += [analyzer for analyzer in [qr_codes, audio_time_codes] if analyzer is not None]
+    format_output = decode_recording(recording, analyzers)
+    if video.output is None:
+        raise Exception(f"No video stream in {recording}.")
+    return RecordingProbe(
+        format=format_output,
+        video=video.output,
+        audio=audio.output,
+        qr_codes=None if qr_codes is None else qr_codes.qr_codes,
+        unique_frame_presentation_time_stamps=[
+            analyzer.presentation_time_stamps for analyzer in unique_frames
+        ],
+        audio_time_codes=None if audio_time_codes is None else audio_time_codes.timecodes,
+    )
+
+
+@dataclass
+class GapEvent:
+    start: float
+    end: float
+    gaps: int
+    missing_duration: float
+
+
+@dataclass
+class PresentationTimeStampGaps:
+    """Deltas between consecutive presentation time stamps that differ from the expected delta
+    by more than the allowed error, with the time stamp after each of them.
+    """
+
+    expected_delta: float
+    presentation_time_stamps: np.ndarray
+    deltas: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.deltas)
+
+    def missing(self) -> list[tuple[float, float]]:
+        return list(zip(self.presentation_time_stamps.tolist(), self.deltas.tolist()))
+
+    def size_classes(self) -> dict[str, int]:
+        missing_frames = np.rint(self.deltas / self.expected_delta) - 1
+        return {
+            name: int(np.count_nonzero((missing_frames >= minimum) & (missing_frames < maximum)))
+            for name, minimum, maximum in GAP_SIZE_CLASSES
+        }
+
+    def longest(self) -> float:
+        return float(self.deltas.max(initial=0))
+
+    def missing_duration(self) -> float:
+        return float(np.clip(self.deltas - self.expected_delta, 0, None).sum())
+
+    def events(self) -> list[GapEvent]:
+        starts = self.presentation_time_stamps - self.deltas
+        splits = np.flatnonzero(starts[1:] - self.presentation_time_stamps[:-1] > GAP_EVENT_SEPARATION) + 1
+        return [
+            GapEvent(
+                start=float(event_starts[0]),
+                end=float(event_ends[-1]),
+                gaps=len(event_deltas),
+                missing_duration=float(np.clip(event_deltas - self.expected_delta, 0, None).sum()),
+            )
+            for event_starts, event_ends, event_deltas in zip(
+                np.split(starts, splits),
+                np.split(self.presentation_time_stamps, splits),
+                np.split(self.deltas, splits),
+            )
+            if len(event_deltas) > 0
         ]
-        audio_time_codes_future = executor.submit(_read_audio_time_codes, recording, has_audio_time_codes)
-        return RecordingProbe(
-            format=format_future.result(),
-            video=video_future.result(),
-            audio=audio_future.result(),
-            qr_codes=qr_codes_future.result(),
-            unique_frame_presentation_time_stamps=[future.result() for future in unique_frames_futures],
-            audio_time_codes=audio_time_codes_future.result(),
+
+    def log(self, name: str):
+        for time_stamp, delta in self.missing():
+            LOGGER.debug("%s: Missing PTS: %s (Delta: %s)", name, time_stamp, delta)
+        events = self.events()
+        for event in events:
+            LOGGER.info(
+                "%s: Missing PTS from %.3f to %.3f s (%s gaps, %.3f s missing)",
+                name,
+                event.start,
+                event.end,
+                event.gaps,
+                event.missing_duration,
+            )
+        LOGGER.info(
+            "%s: %s gaps (%s) in %s events, longest %.3f s, %.3f s missing",
+            name,
+            len(self),
+            ", ".join(
+                f"{count} {size_class}" for size_class, count in self.size_classes().items() if count > 0
+            ),
+            len(events),
+            self.longest(),
+            self.missing_duration(),
         )
 
 
-def _read_qr_codes(recording: Path, has_qr_codes: bool) -> list[QrCode] | None:
-    if not has_qr_codes:
-        return None
-    return read_qr_codes(recording, Crop(x=150, y=0, width=400, height=400))
-
-
-def _read_audio_time_codes(recording: Path, has_audio_time_codes: bool) -> str | None:
-    if not has_audio_time_codes:
-        return None
-    ltc_wav = FILES_DIR / "ltc.wav"
-    extract_ltc_wav(recording, ltc_wav)
-    return subprocess.run(
-        ["ltcdump", "--fps", "30", str(ltc_wav)],
-        check=True,
-        capture_output=True,
-        text=True,
-    ).stdout
-
-
-def find_missing_presentation_time_stamps(
-    expected_delta: float, presentation_time_stamps: list[float], delta_error: float
-) -> list[tuple[float, float]]:
-    missing_presentation_time_stamps = []
-    for index in range(1, len(presentation_time_stamps)):
-        current = presentation_time_stamps[index]
-        previous = presentation_time_stamps[index - 1]
-        delta = current - previous
-        if delta < expected_delta - delta_error or delta > expected_delta + delta_error:
-            missing_presentation_time_stamps.append((current, delta))
-    return missing_presentation_time_stamps
+def find_presentation_time_stamp_gaps(
+    expected_delta: float, presentation_time_stamps: Sequence[float], delta_error: float
+) -> PresentationTimeStampGaps:
+    time_stamps = np.asarray(presentation_time_stamps, dtype=np.float64)
+    deltas = np.diff(time_stamps)
+    gaps = (deltas < expected_delta - delta_error) | (deltas > expected_delta + delta_error)
+    return PresentationTimeStampGaps(expected_delta, time_stamps[1:][gaps], deltas[gaps])
@@ -1,15 +1,25 @@
+import hashlib
 import subprocess
 import time
+from collections import OrderedDict
 from collections.abc import Callable
 from dataclasses import dataclass
 from logging import Logger
 from pathlib import Path
+from typing import Generic
+from typing import TypeVar
 from urllib.parse import urlsplit
 
+import numpy as np
+
 TEST_DIR = Path(__file__).parent.parent.resolve()
 WEBSITES_DIR = TEST_DIR / "suites" / "websites"
 FILES_DIR = TEST_DIR / "files"
 BLACK_MAXIMUM_VALUE = 40
+# Identical frames are mostly close to each other, like a static scene or a frozen stream.
+FRAME_CACHE_SIZE = 256
+
+T = TypeVar("T")
 
 
 @dataclass
@@ -70,37 +80,93 @@ class Pixel:
 
 
 class Image:
-    """A RGB image, typically a cropped part of a video frame."""
+    """A RGB image, typically a cropped part of a video frame. The pixels are a view of the
+    raw data, without copying it, with one row of red, green and blue values per line.
+    """
 
-    def __init__(self, width: int, height: int, data: bytes):
+    def __init__(self, width: int, height: int, data: bytes | np.ndarray):
         self.width = width
         self.height = height
-        self._data = data
+        if not isinstance(data, np.ndarray):
+            data = np.frombuffer(data, np.uint8)
+        self.pixels = data.reshape(height, width, 3)
 
     def pixel(self, x: int, y: int) -> Pixel:
-        offset = 3 * (self.width * y + x)
-        return Pixel(*self._data[offset : offset + 3])
+        return Pixel(*self.pixels[y, x].tolist())
 
     def contains(self, x: int, y: int) -> bool:
         return 0 <= x < self.width and 0 <= y < self.height
 
+    def crop(self, crop: Crop) -> "Image":
+        """The part of the image inside a crop, as a view of the same pixels. Parts of the crop
+        outside of the image are left out.
+        """
+        x = min(max(crop.x, 0), self.width)
+        y = min(max(crop.y, 0), self.height)
+        width = min(max(crop.x + crop.width, x), self.width) - x
+        height = min(max(crop.y + crop.height, y), self.height) - y
+        return Image(width, height, self.pixels[y : y + height, x : x + width])
+
+    def mask(self, predicate: Callable[[np.ndarray, np.ndarray, np.ndarray], np.ndarray]) -> np.ndarray:
+        """Whether each pixel fulfills a predicate of the red, green and blue values, which are
+        given as signed integers for all pixels at once.
+        """
+        red, green, blue = np.moveaxis(self.pixels.astype(np.int16), 2, 0)
+        return predicate(red, green, blue)
+
+    def black_mask(self) -> np.ndarray:
+        return self.pixels.max(axis=2, initial=0) <= BLACK_MAXIMUM_VALUE
+
     def is_all_black(self) -> bool:
-        return max(self._data, default=0) <= BLACK_MAXIMUM_VALUE
+        return int(self.pixels.max(initial=0)) <= BLACK_MAXIMUM_VALUE
 
     def find_non_black_pixel(self) -> tuple[int, int] | None:
-        for y in range(self.height):
-            for x in range(self.width):
-                if not self.pixel(x, y).is_black():
-                    return x, y
-        return None
+        non_black = np.flatnonzero(~self.black_mask())
+        if len(non_black) == 0:
+            return None
+        y, x = divmod(int(non_black[0]), self.width)
+        return x, y
 
     def non_black_ratio(self) -> float:
-        non_black = sum(
-            1
-            for offset in range(0, len(self._data), 3)
-            if max(self._data[offset : offset + 3]) > BLACK_MAXIMUM_VALUE
-        )
-        return non_black / (self.width * self.height)
+        return np.count_nonzero(~self.black_mask()) / max(self.width * self.height, 1)
+
+    def mean_color(self, mask: np.ndarray | None = None) -> tuple[float, float, float]:
+        """The average red, green and blue values of the pixels, or of those in a mask."""
+        pixels = self.pixels.reshape(-1, 3) if mask is None else self.pixels[mask]
+        if len(pixels) == 0:
+            return 0.0, 0.0, 0.0
+        red, green, blue = pixels.mean(axis=0).tolist()
+        return red, green, blue
+
+
+def frame_hash(*pixels: bytes | np.ndarray) -> bytes:
+    """A fast hash of the raw pixels of a frame, or a crop of it."""
+    digest = hashlib.blake2b(digest_size=16)
+    for part in pixels:
+        digest.update(np.ascontiguousarray(part).data if isinstance(part, np.ndarray) else part)
+    return digest.digest()
+
+
+class FrameCache(Generic[T]):
+    """The most recently used results computed from frame contents, keyed by frame hashes."""
+
+    def __init__(self, size: int = FRAME_CACHE_SIZE):
+        self._size = size
+        self._results: OrderedDict[bytes, T] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: bytes, compute: Callable[[], T]) -> T:
+        if key in self._results:
+            self._results.move_to_end(key)
+            self.hits += 1
+            return self._results[key]
+        result = compute()
+        self._results[key] = result
+        if len(self._results) > self._size:
+            self._results.popitem(last=False)
+        self.misses += 1
+        return result
 
 
 def create_qr_code_image(text: str, output_image: Path):